@@ -0,0 +1,170 @@
+"""
+admission.py — Admission control and per‑user rate limiting for the API gateway
+
+• Global in‑flight limit with a short, bounded wait queue → 503 + Retry‑After
+• Per‑user token bucket keyed by the Clerk `sub`          → 429 + Retry‑After
+• In‑flight, queue depth, wait time and rejections are exported as metrics
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import Counter, Gauge, Histogram
+
+IN_FLIGHT = Gauge("slurpy_admission_in_flight", "Chat requests currently admitted")
+QUEUE_DEPTH = Gauge("slurpy_admission_queue_depth", "Chat requests waiting for a slot")
+WAIT_SECONDS = Histogram(
+    "slurpy_admission_wait_seconds", "Time spent waiting for an admission slot",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0),
+)
+REJECTED = Counter(
+    "slurpy_admission_rejected_total", "Requests rejected by admission control", ("reason",),
+)
+
+
+class Rejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry‑After seconds."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """Take one token; return 0 on success, else seconds until one is available."""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / rate
+
+
+class Lease:
+    """An admitted request's slot; release() is idempotent."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+    async def __aenter__(self) -> "Lease":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight: int = 32,
+        max_queue: int = 64,
+        queue_timeout: float = 2.0,
+        user_rate: float = 20 / 60,
+        user_burst: float = 5,
+        max_tracked_users: int = 100_000,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_tracked_users = max_tracked_users
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._waiting = 0
+
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._buckets_lock = threading.Lock()
+
+    # ── per-user rate limit ─────────────────────────────────────────────────
+    def check_user(self, user_id: str) -> None:
+        """Spend one token from the user's bucket or raise Rejected(429)."""
+        if self.user_rate <= 0:
+            return
+        now = time.monotonic()
+        with self._buckets_lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_burst, now)
+                self._buckets[user_id] = bucket
+                # Least-recently-seen buckets have long since refilled; dropping them is lossless
+                while len(self._buckets) > self.max_tracked_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+            wait = bucket.take(self.user_rate, self.user_burst, now)
+        if wait > 0:
+            REJECTED.inc(reason="user_rate")
+            raise Rejected(429, "Too many messages — please slow down", math.ceil(wait))
+
+    def refund_user(self, user_id: str) -> None:
+        """Give back the token check_user spent on a request that was then never served."""
+        if self.user_rate <= 0:
+            return
+        with self._buckets_lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is not None:
+                bucket.tokens = min(self.user_burst, bucket.tokens + 1.0)
+
+    # ── global in-flight limit ──────────────────────────────────────────────
+    async def admit(self) -> Lease:
+        """Take an in‑flight slot, waiting briefly in a bounded queue, or raise Rejected(503)."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        if self._slots.locked():
+            if self._waiting >= self.max_queue:
+                REJECTED.inc(reason="queue_full")
+                raise Rejected(503, "Server busy — please retry shortly", self._retry_after())
+            self._waiting += 1
+            QUEUE_DEPTH.set(self._waiting)
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                REJECTED.inc(reason="queue_timeout")
+                raise Rejected(503, "Server busy — please retry shortly", self._retry_after())
+            finally:
+                self._waiting -= 1
+                QUEUE_DEPTH.set(self._waiting)
+                WAIT_SECONDS.observe(time.perf_counter() - started)
+        else:
+            await self._slots.acquire()
+            WAIT_SECONDS.observe(0.0)
+
+        self._in_flight += 1
+        IN_FLIGHT.set(self._in_flight)
+        return Lease(self)
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        IN_FLIGHT.set(self._in_flight)
+        if self._slots is not None:
+            self._slots.release()
+
+    def _retry_after(self) -> int:
+        # Roughly one queue-timeout per full queue ahead of the caller
+        backlog = (self._waiting + 1) / max(1, self.max_in_flight)
+        return max(1, math.ceil(self.queue_timeout * backlog))
@@ -3,28 +3,73 @@
 api.py — FastAPI gateway for Slurpy with Personality Modes
 ----------------------------------------------------------
 • POST /chat   → chats with Slurpy (JWT‑only auth, optional DEV bypass)
+• POST /chat/stream → same, streamed as Server‑Sent Events (meta → token… → done)
 • GET  /modes  → list personality modes + default
 • GET  /health → liveness
+• GET  /metrics → Prometheus metrics (per‑stage latency histograms, session cache)
+
+Production: gunicorn -c gunicorn.conf.py api:app (models preloaded in the master)
 
 Env
 - API_DEBUG            (true/false)    → verbose logs
 - DEV_NO_AUTH          (true/false)    → bypass Clerk verification, use "dev_user"
 - FRONTEND_ORIGIN      (e.g. http://localhost:3000) → CORS allowlist
+- CHAT_CPU_WORKERS     (int)           → threads for model inference
+- CHAT_IO_WORKERS      (int)           → threads for Qdrant/SQLite/HTTP calls
+- CHAT_MAX_CONCURRENCY (int)           → CPU-bound stages admitted to the executor at once
+- SESSION_MAX          (int)           → cached chat sessions before LRU eviction
+- SESSION_MAX_BYTES    (int)           → approximate byte budget for cached history text
+- SESSION_IDLE_TTL     (seconds)       → idle sessions expire (rebuilt from SQLite on return)
+- METRICS_ENABLED      (true/false)    → /metrics + Server‑Timing headers (default on)
+- ADMISSION_MAX_IN_FLIGHT (int)        → chat turns processed at once per worker
+- ADMISSION_MAX_QUEUE     (int)        → turns allowed to wait for a slot (else 503)
+- ADMISSION_QUEUE_TIMEOUT (seconds)    → longest wait for a slot (else 503)
+- USER_RATE_PER_MIN       (float)      → per‑user sustained chat rate (else 429; 0 disables)
+- USER_BURST              (int)        → per‑user burst allowance
+- WRITE_BEHIND_SPILL      (path prefix) → per‑worker JSONL spill files for writes whose sink is down
+- MEMORY_WAL              (path prefix) → write‑ahead log for batched memory upserts (see upsert_buffer.py)
+- MEMORY_USER_CACHE       (true/false) → keep hot users' memory vectors in process (see user_vector_cache.py)
+- EMOTION_BACKEND         (eager|onnx|onnx-int8) → emotion classifier runtime (see emotion/export_onnx.py)
+- EMOTION_BATCH_MAX       (int)        → most messages per emotion forward pass
+- EMOTION_BATCH_WAIT_MS   (float)      → how long a batch waits for company
+- MODEL_WARMUP            (true/false) → warm the models before a worker reports ready (see prefork.py)
+- MODEL_SERVER_SOCKET     (path)       → share one emotion/embedding model server per pod (see model_server.py)
 """
 
 from __future__ import annotations
 
+import json
 import os
 import uuid
-from collections import deque
-from typing import Deque, Dict, Tuple
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Dict
 
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 
-from auth_clerk import verify_clerk_token
-from rag_core import slurpy_answer, get_available_modes, DEFAULT_MODE
+import httpx
+from jose import JWTError
+
+import memory
+import metrics
+import prefork
+from admission import AdmissionController, Lease, Rejected
+from auth_clerk import verify_clerk_token_async
+from rag_core import (
+    slurpy_answer_async,
+    slurpy_answer_stream,
+    get_available_modes,
+    flush_writes,
+    start_writes,
+    load_session_history,
+    run_io,
+    shutdown_executors,
+    DEFAULT_MODE,
+)
+from session_store import SessionStore
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Debug toggle
@@ -36,7 +81,21 @@ def dbg(*args, **kwargs):
 
 # ─────────────────────────────────────────────────────────────────────────────
 # App + CORS
-app = FastAPI(title="Slurpy RAG API with Personality Modes", version="2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Qdrant connects (and retries) in the background; memory is degraded until then
+    memory.connect_in_background()
+    # Write-behind workers recover and replay earlier unwritten writes on their own thread
+    start_writes()
+    # Warm the models before this worker accepts traffic
+    await run_io(prefork.warmup)
+    yield
+    # Let in-flight inference finish, then drain queued memory/analytics/sync writes
+    shutdown_executors()
+    flush_writes()
+
+app = FastAPI(title="Slurpy RAG API with Personality Modes", version="2.0", lifespan=lifespan)
+metrics.register_stats("slurpy_worker", "Worker startup and memory", prefork.stats)
 
 _frontend_origin = os.getenv("FRONTEND_ORIGIN", "http://localhost:3000").strip()
 _allow_all = os.getenv("CORS_ALLOW_ALL", "false").lower() in {"1", "true", "yes"}
@@ -47,10 +106,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+if metrics.ENABLED:
+    @app.middleware("http")
+    async def server_timing(request: Request, call_next):
+        """Collect per-stage timings for this request and echo them as Server-Timing."""
+        timings = metrics.begin_request()
+        response = await call_next(request)
+        header = timings.server_timing()
+        if header:
+            response.headers["Server-Timing"] = header
+        return response
+
 # ─────────────────────────────────────────────────────────────────────────────
-def get_clerk_user_id(req: Request) -> str:
+async def get_clerk_user_id(req: Request) -> str:
     """Extract and verify Clerk token from Authorization header."""
     # Local/dev bypass (optional)
     if os.getenv("DEV_NO_AUTH", "false").lower() in {"1", "true", "yes"}:
@@ -68,7 +139,21 @@ def get_clerk_user_id(req: Request) -> str:
 
     token = auth_header.split(" ", 1)[1]
     dbg("🔍 Verifying token...")
-    claims = verify_clerk_token(token)
+    try:
+        claims = await verify_clerk_token_async(token)
+    except (JWTError, ValueError, KeyError) as e:
+        dbg("❌ Token rejected:", e)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Clerk session token",
+        )
+    except httpx.HTTPError as e:
+        # No signing keys yet and Clerk is unreachable: not the client's fault
+        print(f"⚠️ Clerk JWKS unavailable: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service unavailable",
+        )
     dbg("✅ Token verified. User ID:", claims.get("sub"))
 
     sub = claims.get("sub")
@@ -79,6 +164,34 @@ def get_clerk_user_id(req: Request) -> str:
         )
     return sub
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Admission control: shed load early instead of queueing until clients time out
+admission = AdmissionController(
+    max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2.0")),
+    user_rate=float(os.getenv("USER_RATE_PER_MIN", "20")) / 60,
+    user_burst=float(os.getenv("USER_BURST", "5")),
+)
+
+async def admit_chat(user_id: str) -> Lease:
+    """Apply the per-user rate limit, then take a global in-flight slot."""
+    try:
+        admission.check_user(user_id)
+        try:
+            return await admission.admit()
+        except BaseException:
+            # Shed (or cancelled) before being served: don't charge the user's rate limit
+            admission.refund_user(user_id)
+            raise
+    except Rejected as e:
+        dbg(f"🚦 Rejected {user_id}: {e.detail}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Models
 class ChatRequest(BaseModel):
@@ -109,9 +222,19 @@ class ModesResponse(BaseModel):
     default_mode: str
 
 # ─────────────────────────────────────────────────────────────────────────────
-# In‑memory session history per (user_id, session_id)
-History = Deque[Tuple[str, str, str]]  # (user_text, assistant_text, user_emotion)
-histories: Dict[tuple[str, str], History] = {}
+# Bounded session history per (user_id, session_id); misses reload from SQLite
+sessions = SessionStore(
+    loader=load_session_history,
+    max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+    max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "3600")),
+    history_len=6,
+)
+metrics.register_stats("slurpy_sessions", "Session history cache", sessions.stats)
+
+async def _session_history(user_id: str, session_id: str, client_supplied: bool):
+    # Fresh server-generated ids can't have stored history — skip the DB read
+    return await run_io(sessions.get, user_id, session_id, client_supplied)
 
 def _sanitize_mode(requested: str) -> str:
     try:
@@ -135,35 +258,37 @@ async def chat_endpoint(payload: ChatRequest, req: Request):
                 detail="Field 'text' is required.",
             )
 
-        user_id = get_clerk_user_id(req)
-        sid = payload.session_id or str(uuid.uuid4())
-        mode = _sanitize_mode(payload.mode or DEFAULT_MODE)
-
-        key = (user_id, sid)
-        hist = histories.setdefault(key, deque(maxlen=6))
-
-        dbg(f"📚 Using session: {sid} for user: {user_id}")
-        dbg(f"🎭 Using mode: {mode}")
-        dbg("💬 Calling slurpy_answer...")
-
-        # Ensure rag_core uses the SAME session_id we use here
-        answer, emotion, fruit = slurpy_answer(
-            payload.text,
-            hist,
-            user_id=user_id,
-            mode=mode,
-            session_id=sid,  # ← pass through session id
-        )
+        user_id = await get_clerk_user_id(req)
+        lease = await admit_chat(user_id)
+        async with lease:
+            sid = payload.session_id or str(uuid.uuid4())
+            mode = _sanitize_mode(payload.mode or DEFAULT_MODE)
+
+            hist = await _session_history(user_id, sid, payload.session_id is not None)
+
+            dbg(f"📚 Using session: {sid} for user: {user_id}")
+            dbg(f"🎭 Using mode: {mode}")
+            dbg("💬 Calling slurpy_answer...")
+
+            # Ensure rag_core uses the SAME session_id we use here
+            answer, emotion, fruit = await slurpy_answer_async(
+                payload.text,
+                hist,
+                user_id=user_id,
+                mode=mode,
+                session_id=sid,  # ← pass through session id
+            )
+            sessions.commit(user_id, sid)
 
-        dbg("✅ Slurpy replied:", answer)
+            dbg("✅ Slurpy replied:", answer)
 
-        return ChatResponse(
-            session_id=sid,
-            message=answer,
-            emotion=emotion,
-            fruit=fruit,
-            mode=mode,
-        )
+            return ChatResponse(
+                session_id=sid,
+                message=answer,
+                emotion=emotion,
+                fruit=fruit,
+                mode=mode,
+            )
     except HTTPException:
         raise
     except Exception as e:
@@ -171,6 +296,58 @@ async def chat_endpoint(payload: ChatRequest, req: Request):
         print("🔥 INTERNAL ERROR:", str(e))
         raise HTTPException(status_code=500, detail="Server error")
 
+# ─────────────────────────────────────────────────────────────────────────────
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(payload: ChatRequest, req: Request):
+    """Stream a reply as SSE: `meta` (emotion/fruit) first, then `token` deltas, then `done`."""
+    dbg("\n🌐 /chat/stream endpoint hit!")
+
+    if not payload.text or not isinstance(payload.text, str):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Field 'text' is required.",
+        )
+
+    # Auth happens before the stream starts so failures are plain HTTP errors
+    user_id = await get_clerk_user_id(req)
+    lease = await admit_chat(user_id)
+    try:
+        sid = payload.session_id or str(uuid.uuid4())
+        mode = _sanitize_mode(payload.mode or DEFAULT_MODE)
+        hist = await _session_history(user_id, sid, payload.session_id is not None)
+    except BaseException:
+        lease.release()
+        raise
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            # aclosing: on disconnect the answer stream records its partial turn before we commit
+            async with aclosing(slurpy_answer_stream(
+                payload.text, hist, user_id=user_id, mode=mode, session_id=sid
+            )) as stream:
+                async for event, data in stream:
+                    yield _sse(event, data)
+        except Exception as e:
+            print("🔥 STREAM ERROR:", str(e))
+            yield _sse("error", {"detail": "Server error"})
+        finally:
+            sessions.commit(user_id, sid)
+            lease.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache, no-transform",
+            "X-Accel-Buffering": "no",
+        },
+        # Frees the slot even if the client disconnects before the body starts
+        background=BackgroundTask(lease.release),
+    )
+
 # ─────────────────────────────────────────────────────────────────────────────
 @app.get("/modes", response_model=ModesResponse)
 async def get_modes_endpoint():
@@ -185,6 +362,13 @@ async def get_modes_endpoint():
         print("🔥 ERROR getting modes:", str(e))
         raise HTTPException(status_code=500, detail="Server error")
 
+# ─────────────────────────────────────────────────────────────────────────────
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # ─────────────────────────────────────────────────────────────────────────────
 @app.get("/health")
 async def health():
@@ -1,35 +1,172 @@
 """
-Minimal Clerk JWT verifier with in‑memory JWKS cache
+Clerk JWT verifier with verified‑claims cache and single‑flight JWKS refresh
+
+• Verified claims are cached by token hash until the token's `exp` (bounded LRU)
+• kid → key index is built once per JWKS download
+• JWKS refresh is async and single‑flight: a stale key set keeps serving while
+  one background refresh runs; an unknown kid forces a (rate‑limited) refresh
+• A failed refresh keeps serving the keys we already have; only a cold start
+  with Clerk unreachable raises httpx.HTTPError (the API answers 503)
 """
 
-import os, time, httpx, cachetools
+import asyncio, hashlib, os, threading, time, httpx
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
 from jose import jwt, JWTError
 
 JWKS_URL = os.getenv(
     "CLERK_JWKS_URL",
-    "https://concrete-lark-31.clerk.accounts.dev/.well-known/jwks.json",       
+    "https://concrete-lark-31.clerk.accounts.dev/.well-known/jwks.json",
 )
 _ALG = "RS256"
-_CACHE_TTL = 60 * 60            # 1 h
+_CACHE_TTL = 60 * 60            # 1 h
+_UNKNOWN_KID_COOLDOWN = 30      # min seconds between forced refreshes
+_CLAIMS_CACHE_SIZE = int(os.getenv("CLERK_CLAIMS_CACHE_SIZE", "10000"))
+
+# ── JWKS key index ──────────────────────────────────────────────────────────
+_keys: Dict[str, dict] = {}     # kid → JWK, swapped wholesale on refresh
+_fetched_at = 0.0
+_forced_at = 0.0
+_sync_lock = threading.Lock()
+_inflight: Optional["asyncio.Future[None]"] = None
+_background: Set["asyncio.Future[None]"] = set()  # strong refs: the loop only keeps weak ones
+
+def _install_jwks(keys: list) -> None:
+    global _keys, _fetched_at
+    _keys = {k["kid"]: k for k in keys if "kid" in k}
+    _fetched_at = time.monotonic()
+
+def _is_stale() -> bool:
+    return time.monotonic() - _fetched_at > _CACHE_TTL
 
-@cachetools.cached(cachetools.TTLCache(maxsize=1, ttl=_CACHE_TTL))
 def _fetch_jwks():
-    """Download Clerk’s JWKS once per hour (no auth header!)."""
-    resp = httpx.get(JWKS_URL, timeout=5.0)
-    resp.raise_for_status()
-    return resp.json()["keys"]
+    """Blocking download of Clerk’s JWKS (no auth header!) for sync callers."""
+    with _sync_lock:
+        if _keys and not _is_stale():
+            return list(_keys.values())
+        resp = httpx.get(JWKS_URL, timeout=5.0)
+        resp.raise_for_status()
+        _install_jwks(resp.json()["keys"])
+        return list(_keys.values())
+
+async def _download_jwks() -> None:
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        resp = await client.get(JWKS_URL)
+        resp.raise_for_status()
+        _install_jwks(resp.json()["keys"])
+
+async def refresh_jwks() -> None:
+    """Refresh the JWKS; concurrent callers share one download."""
+    global _inflight
+    if _inflight is None or _inflight.done():
+        _inflight = asyncio.ensure_future(_download_jwks())
+    await asyncio.shield(_inflight)
+
+def _refresh_in_background() -> None:
+    async def _run():
+        try:
+            await refresh_jwks()
+        except Exception as e:
+            print(f"⚠️ Background JWKS refresh failed: {e}")
+    if _inflight is None or _inflight.done():
+        task = asyncio.ensure_future(_run())
+        _background.add(task)
+        task.add_done_callback(_background.discard)
 
 def _get_signing_key(kid: str):
-    for key in _fetch_jwks():
-        if key["kid"] == kid:
-            return key
-    raise ValueError(f"Signing key {kid} not found in Clerk JWKS")
+    key = _keys.get(kid)
+    if key is None or _is_stale():
+        try:
+            _fetch_jwks()
+        except httpx.HTTPError as e:
+            if not _keys:
+                raise
+            print(f"⚠️ JWKS refresh failed, using cached keys: {e}")
+        key = _keys.get(kid)
+    if key is None:
+        raise ValueError(f"Signing key {kid} not found in Clerk JWKS")
+    return key
+
+async def _get_signing_key_async(kid: str):
+    global _forced_at
+    if not _keys:
+        await refresh_jwks()
+    elif _is_stale():
+        # Serve the current keys; refresh without blocking this request
+        _refresh_in_background()
+
+    key = _keys.get(kid)
+    if key is None and time.monotonic() - _forced_at > _UNKNOWN_KID_COOLDOWN:
+        # Key rotation: a kid we have never seen forces one refresh
+        _forced_at = time.monotonic()
+        try:
+            await refresh_jwks()
+        except httpx.HTTPError as e:
+            print(f"⚠️ JWKS refresh for unknown kid failed: {e}")
+        key = _keys.get(kid)
+    if key is None:
+        raise ValueError(f"Signing key {kid} not found in Clerk JWKS")
+    return key
+
+# ── Verified claims cache ──────────────────────────────────────────────────
+_claims: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+_claims_lock = threading.Lock()
 
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _cached_claims(token_hash: str) -> Optional[dict]:
+    with _claims_lock:
+        hit = _claims.get(token_hash)
+        if hit is None:
+            return None
+        claims, exp = hit
+        if exp <= time.time():
+            del _claims[token_hash]
+            return None
+        _claims.move_to_end(token_hash)
+        return dict(claims)
+
+def _cache_claims(token_hash: str, claims: dict) -> None:
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)):
+        return  # never cache a token without an expiry
+    with _claims_lock:
+        _claims[token_hash] = (dict(claims), float(exp))
+        _claims.move_to_end(token_hash)
+        while len(_claims) > _CLAIMS_CACHE_SIZE:
+            _claims.popitem(last=False)
+
+def _decode(token: str, key) -> dict:
+    return jwt.decode(token, key, algorithms=[_ALG], options={"verify_aud": False})
+
+# ── Public API ──────────────────────────────────────────────────────────────
 def verify_clerk_token(token: str) -> dict:
     """Return the token’s claims or raise 401‐style JWTError."""
+    token_hash = _token_hash(token)
+    cached = _cached_claims(token_hash)
+    if cached is not None:
+        return cached
     try:
         headers = jwt.get_unverified_header(token)
         key = _get_signing_key(headers["kid"])
-        return jwt.decode(token, key, algorithms=[_ALG], options={"verify_aud": False})
+        claims = _decode(token, key)
+    except JWTError as e:
+        raise JWTError(f"Invalid Clerk JWT: {e}") from e
+    _cache_claims(token_hash, claims)
+    return claims
+
+async def verify_clerk_token_async(token: str) -> dict:
+    """Async verify_clerk_token: JWKS downloads never block the event loop."""
+    token_hash = _token_hash(token)
+    cached = _cached_claims(token_hash)
+    if cached is not None:
+        return cached
+    try:
+        headers = jwt.get_unverified_header(token)
+        key = await _get_signing_key_async(headers["kid"])
+        claims = _decode(token, key)
     except JWTError as e:
         raise JWTError(f"Invalid Clerk JWT: {e}") from e
+    _cache_claims(token_hash, claims)
+    return claims
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+check_import_time.py — Import‑time budget for the API entry point
+
+Runs `python -X importtime -c "import api"` in a fresh interpreter and fails
+(exit 1) when
+• the cumulative import time of the module exceeds the budget, or
+• a heavy module that should only load on first use (torch, transformers,
+  sentence‑transformers, …) is imported eagerly
+
+Prints the slowest imports either way, so a regression points at its cause.
+Qdrant is neither configured nor contacted during the check.
+
+  python check_import_time.py                   # import api, 4000 ms budget
+  python check_import_time.py --module rag_core --budget-ms 2000
+
+Env
+- IMPORT_BUDGET_MS  (default 4000)
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+LAZY_MODULES = ("torch", "transformers", "sentence_transformers", "langchain_huggingface",
+                "langchain_qdrant", "onnxruntime")
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def measure(module: str) -> List[Tuple[int, int, int, str]]:
+    """(self µs, cumulative µs, depth, name) per import, in import order."""
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("QDRANT_", "MODEL_SERVER_"))}
+    env.setdefault("OPENAI_API_KEY", "sk-import-check")  # ChatOpenAI validates it at import, no request is made
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"❌ import {module} failed")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2, m.group(4)))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fail when importing the API gets slow or heavy")
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "4000")))
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args()
+
+    rows = measure(args.module)
+    total_ms = next((cum for _, cum, _, name in rows if name == args.module), 0) / 1000
+    eager = sorted({name for _, _, _, name in rows if name.split(".")[0] in LAZY_MODULES
+                    and "." not in name})
+
+    print(f"⏱️ import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    print("   slowest top‑level packages:")
+    top_level = [(cum, name) for _, cum, depth, name in rows if "." not in name and name != args.module]
+    for cum, name in sorted(top_level, reverse=True)[:args.top]:
+        print(f"   {cum / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if total_ms > args.budget_ms:
+        print(f"❌ Over budget by {total_ms - args.budget_ms:.0f} ms")
+        failed = True
+    if eager:
+        print(f"❌ Imported eagerly (should load on first use): {', '.join(eager)}")
+        failed = True
+    if failed:
+        raise SystemExit(1)
+    print("✅ Within budget")
+
+
+if __name__ == "__main__":
+    main()
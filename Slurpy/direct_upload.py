@@ -8,7 +8,7 @@ import pickle
 import uuid
 from qdrant_client import QdrantClient
 from qdrant_client.models import VectorParams, Distance, PointStruct
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from embedding_cache import cached_embedder
 from dotenv import load_dotenv
 from typing import List, Optional
 import argparse
@@ -238,7 +238,7 @@ def upload_points_to_cloud(points: List[PointStruct], replace_existing: bool = F
         
         # Test search to make sure everything works
         print(f"🔍 Testing search functionality...")
-        embedder = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        embedder = cached_embedder()
         test_vector = embedder.embed_query("test search query")
         
         search_results = cloud_client.search(
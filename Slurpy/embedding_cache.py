@@ -0,0 +1,280 @@
+"""
+embedding_cache.py — Content‑addressed cache in front of the sentence embedder
+
+• Key = sha256(model name + normalized text), so identical inputs ("hi",
+  "I'm stressed about work") are embedded once per model
+• Bounded in‑memory LRU backed by a SQLite table of float32 blobs that
+  survives restarts (shared safely between workers via WAL)
+• The store remembers which model filled it; switching EMBED_MODEL wipes it
+• Hits (memory or disk) refresh the row's `used` time in batches, so pruning
+  past EMBED_CACHE_MAX_ROWS evicts the least recently used rows (indexed)
+• stats() → hits / misses / hit_ratio, exported on /metrics by memory.py
+
+Env
+- EMBED_MODEL        (default all-MiniLM-L6-v2)
+- EMBED_CACHE_PATH   (default embedding_cache.db; empty → memory tier only)
+- EMBED_CACHE_SIZE   (in‑memory entries, default 4096)
+- EMBED_CACHE_MAX_ROWS (on‑disk entries, default 200000)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embedding_cache.db")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC + collapsed whitespace — differences the embedder can't see anyway."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """SQLite key → float32 blob store, pinned to one model name."""
+
+    def __init__(self, path: str, model_name: str, max_rows: int):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._touched: Dict[str, float] = {}  # key → last hit, written back in batches
+        self._conn = self._open()
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL, used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+        if row is None or row[0] != model_name:
+            if row is not None:
+                print(f"🔄 Embedding model changed ({row[0]} → {model_name}) - clearing embedding cache")
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (model_name,))
+        self._conn.commit()
+
+    def _open(self) -> sqlite3.Connection:
+        self._pid = os.getpid()
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite handles must not cross fork() (cache built in a preforking master)
+        if os.getpid() != self._pid:
+            self._conn = self._open()
+        return self._conn
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, dim, blob in conn.execute(
+                    f"SELECT key, dim, vec FROM embeddings WHERE key IN ({marks})", chunk
+                ):
+                    vec = np.frombuffer(blob, dtype=np.float32)
+                    if vec.shape[0] == dim:
+                        found[key] = vec
+            self._touch_locked(found)
+        return found
+
+    def touch(self, keys: List[str]) -> None:
+        """Note hits served from the memory tier, so hot keys stay on disk too."""
+        with self._lock:
+            self._touch_locked(keys)
+
+    def _touch_locked(self, keys: Any) -> None:
+        now = time.time()
+        for key in keys:
+            self._touched[key] = now
+        if len(self._touched) >= 256:
+            self._flush_touches()
+            self._conn.commit()
+
+    def _flush_touches(self) -> None:
+        if self._touched:
+            self._connection().executemany(
+                "UPDATE embeddings SET used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        now = time.time()
+        with self._lock:
+            self._flush_touches()
+            self._connection().executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vec, used) VALUES (?, ?, ?, ?)",
+                [(k, v.shape[0], v.tobytes(), now) for k, v in items.items()],
+            )
+            self._conn.commit()
+            self._writes += len(items)
+            if self._writes >= 1000:
+                self._writes = 0
+                self._prune()
+
+    def _prune(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_rows:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY used LIMIT ?)",
+                (count - self.max_rows,),
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._flush_touches()
+                self._conn.commit()
+            finally:
+                self._conn.close()
+
+
+class CachedEmbeddings:
+    """Drop‑in for a LangChain embedder (embed_query / embed_documents) with caching."""
+
+    def __init__(self, inner: Any, model_name: str,
+                 path: Optional[str] = EMBED_CACHE_PATH,
+                 max_items: int = EMBED_CACHE_SIZE,
+                 max_rows: int = EMBED_CACHE_MAX_ROWS):
+        self.inner = inner
+        self.model_name = model_name
+        self.max_items = max_items
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[_DiskTier] = None
+        if path:
+            try:
+                self._disk = _DiskTier(path, model_name, max_rows)
+            except Exception as e:
+                print(f"⚠️ Embedding cache store unavailable ({path}): {e} - using memory tier only")
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ── LangChain embedder interface ────────────────────────────────────────
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], query=True)[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts), query=False)
+
+    # ── cache ───────────────────────────────────────────────────────────────
+    def _embed(self, texts: List[str], query: bool) -> List[List[float]]:
+        keys = [cache_key(self.model_name, t) for t in texts]
+        vectors: Dict[str, np.ndarray] = {}
+
+        with self._lock:
+            for key in keys:
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    vectors[key] = vec
+            self.memory_hits += sum(1 for k in keys if k in vectors)
+        if vectors and self._disk is not None:
+            try:
+                self._disk.touch(list(vectors))
+            except Exception as e:
+                print(f"⚠️ Embedding cache touch failed: {e}")
+
+        pending = [k for k in dict.fromkeys(keys) if k not in vectors]
+        if pending and self._disk is not None:
+            try:
+                from_disk = self._disk.get_many(pending)
+            except Exception as e:
+                print(f"⚠️ Embedding cache read failed: {e}")
+                from_disk = {}
+            vectors.update(from_disk)
+            self._remember(from_disk)
+            with self._lock:
+                self.disk_hits += sum(1 for k in keys if k in from_disk)
+
+        # Embed each distinct missing text once
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = normalize_text(text)
+        if missing:
+            batch = list(missing.values())
+            if query and len(batch) == 1:
+                raw = [self.inner.embed_query(batch[0])]
+            else:
+                raw = self.inner.embed_documents(batch)
+            fresh = {k: np.asarray(v, dtype=np.float32) for k, v in zip(missing, raw)}
+            vectors.update(fresh)
+            self._remember(fresh)
+            with self._lock:
+                self.misses += sum(1 for k in keys if k in fresh)
+            if self._disk is not None:
+                try:
+                    self._disk.put_many(fresh)
+                except Exception as e:
+                    print(f"⚠️ Embedding cache write failed: {e}")
+
+        return [vectors[k].tolist() for k in keys]
+
+    def _remember(self, items: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for key, vec in items.items():
+                self._lru[key] = vec
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+def cached_embedder(model_name: str = EMBED_MODEL, remote: bool = True, **kwargs: Any) -> CachedEmbeddings:
+    """
+    HuggingFaceEmbeddings(model_name) behind the cache. With `remote` and a
+    configured model server, misses go to the server and the local model is
+    only loaded if the server can't be reached.
+    """
+    def local() -> Any:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name)
+
+    client = None
+    if remote:
+        from model_server import get_client
+        client = get_client()
+    if client is not None:
+        from model_server import RemoteEmbeddings
+        return CachedEmbeddings(RemoteEmbeddings(client, model_name, local), model_name, **kwargs)
+    return CachedEmbeddings(local(), model_name, **kwargs)
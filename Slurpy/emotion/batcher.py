@@ -0,0 +1,140 @@
+"""
+emotion/batcher.py — In‑process dynamic micro‑batching for model inference
+
+• submit(item) returns a concurrent.futures.Future immediately
+• One worker thread coalesces concurrent submissions for up to `max_wait`
+  seconds or `max_batch` items, runs the batch function once, and resolves
+  each caller's future with its own result
+• Batch size and time spent queued are exported as histograms
+
+The batch function takes a list of inputs and returns one result per input,
+in order; if it raises, every future in that batch gets the exception.
+close() fails whatever is still queued with RuntimeError.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Generic, List, Optional, Tuple, TypeVar
+
+from metrics import Histogram
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BATCH_SIZE = Histogram(
+    "slurpy_inference_batch_size", "Items per micro-batched forward pass", ("model",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+QUEUE_SECONDS = Histogram(
+    "slurpy_inference_queue_seconds", "Time an item waited before its batch ran", ("model",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+class InferenceBatcher(Generic[T, R]):
+    def __init__(self, fn: Callable[[List[T]], List[R]], name: str,
+                 max_batch: int = 32, max_wait: float = 0.005):
+        self.fn = fn
+        self.name = name
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+
+        self._queue: "queue.Queue[Tuple[T, Future, float]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item: T) -> "Future[R]":
+        if self._thread is None:
+            self._start()
+        fut: "Future[R]" = Future()
+        self._queue.put((item, fut, time.perf_counter()))
+        return fut
+
+    def __call__(self, item: T) -> R:
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(item).result()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": self.items / self.batches if self.batches else 0.0,
+        }
+
+    def close(self) -> None:
+        """Stop the worker; anything still queued fails instead of waiting forever."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        while True:
+            try:
+                _, fut, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if fut.set_running_or_notify_cancel():
+                fut.set_exception(RuntimeError(f"{self.name} batcher closed"))
+
+    # ── worker ──────────────────────────────────────────────────────────────
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=f"batcher-{self.name}",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    # Take whatever is already queued without waiting
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[Tuple[T, Future, float]]) -> None:
+        started = time.perf_counter()
+        live = [(item, fut, queued) for item, fut, queued in batch if fut.set_running_or_notify_cancel()]
+        if not live:
+            return
+        for _, _, queued in live:
+            QUEUE_SECONDS.observe(started - queued, model=self.name)
+        BATCH_SIZE.observe(len(live), model=self.name)
+        self.batches += 1
+        self.items += len(live)
+
+        try:
+            results = self.fn([item for item, _, _ in live])
+            if len(results) != len(live):
+                raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(live)} inputs")
+        except BaseException as e:
+            for _, fut, _ in live:
+                fut.set_exception(e)
+            return
+        for (_, fut, _), result in zip(live, results):
+            fut.set_result(result)
@@ -0,0 +1,359 @@
+"""
+emotion/engine.py — The one emotion inference path (chat, journals, calendar)
+
+• EmotionEngine owns the tokenizer, model/session and the single label map
+  (labels.json, falling back to config.json's id2label)
+• Inputs are truncated to EMOTION_MAX_LENGTH tokens instead of the model's 512
+• Eager PyTorch runs under torch.inference_mode(); ONNX Runtime sessions get
+  the same explicit thread budget
+• Thread budget defaults to cpu_count // WEB_CONCURRENCY so several workers on
+  one pod don't oversubscribe the cores
+• score_long() covers long texts (journals) with overlapping windows scored in
+  one batched pass, under a hard cap on window count
+• default_engine() / default_batcher() are built lazily on first use, or in
+  the gunicorn master via prefork.preload_models() (eager weights load from
+  safetensors when present)
+
+Env
+- EMOTION_MODEL_DIR     (default emotion/model)
+- EMOTION_BACKEND       (eager | onnx | onnx-int8, see emotion/export_onnx.py)
+- EMOTION_MAX_LENGTH    (tokens, default 128)
+- EMOTION_WINDOW_STRIDE (overlap tokens between long‑text windows, default 32)
+- EMOTION_MAX_WINDOWS   (windows scored per long text, default 16)
+- EMOTION_TORCH_THREADS (intra‑op threads; default derived from WEB_CONCURRENCY)
+- EMOTION_BATCH_MAX / EMOTION_BATCH_WAIT_MS → micro‑batcher (emotion/batcher.py)
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from emotion.batcher import InferenceBatcher
+
+MODEL_DIR = os.getenv("EMOTION_MODEL_DIR", "emotion/model")
+BACKEND = os.getenv("EMOTION_BACKEND", "eager").lower()
+MAX_LENGTH = int(os.getenv("EMOTION_MAX_LENGTH", "128"))
+WINDOW_STRIDE = int(os.getenv("EMOTION_WINDOW_STRIDE", "32"))
+MAX_WINDOWS = int(os.getenv("EMOTION_MAX_WINDOWS", "16"))
+ONNX_FILES = {"onnx": "onnx/model.onnx", "onnx-int8": "onnx/model.int8.onnx"}
+
+
+def thread_budget() -> int:
+    """Intra‑op threads for this process: explicit, or the cores split across workers."""
+    explicit = os.getenv("EMOTION_TORCH_THREADS")
+    if explicit:
+        return max(1, int(explicit))
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def safetensors_kwargs(model_dir: str) -> Dict[str, Any]:
+    """
+    Load safetensors when the checkpoint has them: faster than unpickling and
+    no arbitrary code on load. from_pretrained still copies the tensors into
+    torch‑owned memory, so sharing with a preforking parent comes from
+    copy‑on‑write (kept intact by gc.freeze in prefork.py), not from the mmap.
+    Older pytorch_model.bin checkpoints still load (re‑save with
+    save_pretrained() to convert).
+    """
+    if os.path.exists(os.path.join(model_dir, "model.safetensors")):
+        return {"use_safetensors": True}
+    if os.path.isdir(model_dir):
+        print(f"⚠️ {model_dir} has no model.safetensors - loading the pickle checkpoint")
+    return {}
+
+
+_torch_configured = False
+
+def configure_torch_threads(threads: int) -> None:
+    global _torch_configured
+    if _torch_configured:
+        return
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed once any parallel work has run
+    _torch_configured = True
+
+
+def load_labels(model_dir: str) -> List[str]:
+    """Index → label, from labels.json or the model config."""
+    path = os.path.join(model_dir, "labels.json")
+    if not os.path.exists(path):
+        path = os.path.join(model_dir, "config.json")
+        with open(path, encoding="utf-8") as f:
+            mapping: Dict[str, str] = json.load(f)["id2label"]
+    else:
+        with open(path, encoding="utf-8") as f:
+            mapping = json.load(f)
+    return [mapping[str(i)] for i in range(len(mapping))]
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    z = logits - logits.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+@dataclass
+class EmotionPrediction:
+    label: str
+    score: float
+    probs: Optional[Dict[str, float]] = None  # full distribution when requested
+
+
+@dataclass
+class WindowedEmotion:
+    """Long-text score: length-weighted mean over windows plus the most intense window."""
+    label: str
+    score: float
+    peak_label: str
+    peak_score: float
+    timeline: List[Dict[str, Any]]  # per window: start/end char offsets, emotion, intensity
+    truncated: bool = False         # True only if windows had to be sampled
+
+
+def plan_windows(n_tokens: int, body: int, overlap: int, max_windows: int,
+                 max_body: int) -> Tuple[List[Tuple[int, int]], bool]:
+    """
+    (start, end) token spans covering n_tokens under a window cap.
+
+    Over the cap, first drop the overlap, then widen windows up to the model's
+    position limit; only if the text still doesn't fit are windows sampled
+    evenly (and the result flagged truncated).
+    """
+    def spans(size: int, lap: int) -> List[Tuple[int, int]]:
+        step = max(1, size - lap)
+        out, start = [], 0
+        while True:
+            out.append((start, min(start + size, n_tokens)))
+            if start + size >= n_tokens:
+                return out
+            start += step
+
+    if n_tokens <= body:
+        return [(0, n_tokens)], False
+    windows = spans(body, min(overlap, body // 2))
+    if len(windows) <= max_windows:
+        return windows, False
+    windows = spans(body, 0)
+    if len(windows) <= max_windows:
+        return windows, False
+    size = min(max_body, -(-n_tokens // max_windows))
+    windows = spans(size, 0)
+    if len(windows) <= max_windows:
+        return windows, False
+    picks = np.linspace(0, len(windows) - 1, max_windows).round().astype(int)
+    return [windows[i] for i in picks], True
+
+
+class EmotionEngine:
+    def __init__(self, model_dir: str = MODEL_DIR, backend: str = BACKEND,
+                 max_length: int = MAX_LENGTH, threads: Optional[int] = None):
+        from transformers import DistilBertTokenizerFast
+
+        self.model_dir = model_dir
+        self.max_length = max_length
+        self.threads = threads or thread_budget()
+        self.labels = load_labels(model_dir)
+        self.tokenizer = DistilBertTokenizerFast.from_pretrained(model_dir)
+        self._model = None
+        self._session = None
+
+        if backend in ONNX_FILES:
+            path = os.path.join(model_dir, ONNX_FILES[backend])
+            try:
+                import onnxruntime as ort
+                opts = ort.SessionOptions()
+                opts.intra_op_num_threads = self.threads
+                opts.inter_op_num_threads = 1
+                self._session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+                print(f"✅ Emotion model: {backend} ({path}, {self.threads} threads)")
+            except Exception as e:
+                print(f"⚠️ Emotion backend {backend} unavailable ({e}) - falling back to eager")
+                backend = "eager"
+        elif backend != "eager":
+            print(f"⚠️ Unknown EMOTION_BACKEND '{backend}' - using eager")
+            backend = "eager"
+
+        if self._session is None:
+            from transformers import DistilBertForSequenceClassification
+            configure_torch_threads(self.threads)
+            self._model = DistilBertForSequenceClassification.from_pretrained(
+                model_dir, **safetensors_kwargs(model_dir))
+            self._model.eval()
+            print(f"✅ Emotion model: eager ({model_dir}, {self.threads} threads)")
+        self.backend = backend
+
+    def _pad(self, seqs: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        width = max(len(seq) for seq in seqs)
+        input_ids = np.full((len(seqs), width), self.tokenizer.pad_token_id or 0, dtype=np.int64)
+        attention_mask = np.zeros((len(seqs), width), dtype=np.int64)
+        for row, seq in enumerate(seqs):
+            input_ids[row, :len(seq)] = seq
+            attention_mask[row, :len(seq)] = 1
+        return input_ids, attention_mask
+
+    def _forward(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self._session is not None:
+            (logits,) = self._session.run(["logits"], {
+                "input_ids": input_ids, "attention_mask": attention_mask,
+            })
+            return _softmax(logits)
+        import torch
+        with torch.inference_mode():
+            logits = self._model(input_ids=torch.from_numpy(input_ids),
+                                 attention_mask=torch.from_numpy(attention_mask)).logits
+            return torch.softmax(logits, dim=1).numpy()
+
+    def warmup(self) -> float:
+        """One short and one full‑length forward pass; returns the seconds taken."""
+        started = time.perf_counter()
+        self.classify(["warming up", "warming up " * self.max_length])
+        return time.perf_counter() - started
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        return self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+
+    def probs(self, texts: List[str]) -> np.ndarray:
+        """Softmax over labels, one row per text."""
+        if not texts:
+            return np.zeros((0, len(self.labels)), dtype=np.float32)
+        return self._forward(*self._pad(self.tokenize(texts)))
+
+    def classify(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """(label, confidence) per text, in one padded forward pass."""
+        probs = self.probs(texts)
+        idx = probs.argmax(axis=1)
+        return [(self.labels[int(i)], float(row[i])) for i, row in zip(idx, probs)]
+
+    def classify_one(self, text: str) -> Tuple[str, float]:
+        return self.classify([text])[0]
+
+    def score_long(self, text: str, overlap: int = WINDOW_STRIDE,
+                   max_windows: int = MAX_WINDOWS) -> WindowedEmotion:
+        """Score every part of a long text: overlapping windows, one batched forward pass."""
+        enc = self.tokenizer(text or "", add_special_tokens=False, truncation=False,
+                             return_offsets_mapping=True, verbose=False)
+        ids, offsets = enc["input_ids"], enc["offset_mapping"]
+        body = self.max_length - 2  # room for [CLS] … [SEP]
+        max_body = min(self.tokenizer.model_max_length, 512) - 2
+        spans, truncated = plan_windows(len(ids), body, overlap, max_windows, max_body)
+
+        cls, sep = self.tokenizer.cls_token_id, self.tokenizer.sep_token_id
+        probs = self._forward(*self._pad([[cls] + ids[a:b] + [sep] for a, b in spans]))
+
+        weights = np.array([max(1, b - a) for a, b in spans], dtype=np.float64)
+        mean = (probs * weights[:, None]).sum(axis=0) / weights.sum()
+        top = probs.max(axis=1)
+        peak = int(top.argmax())
+
+        timeline = []
+        for (a, b), row in zip(spans, probs):
+            idx = int(row.argmax())
+            timeline.append({
+                "start": offsets[a][0] if a < len(offsets) else 0,
+                "end": offsets[b - 1][1] if 0 < b <= len(offsets) else 0,
+                "emotion": self.labels[idx],
+                "intensity": float(row[idx]),
+            })
+        label = int(mean.argmax())
+        return WindowedEmotion(
+            label=self.labels[label],
+            score=float(mean[label]),
+            peak_label=timeline[peak]["emotion"],
+            peak_score=float(top[peak]),
+            timeline=timeline,
+            truncated=truncated,
+        )
+
+    def predict_stream(self, texts: Iterable[str], batch_size: int = 64, full: bool = False,
+                       chunk_size: int = 4096) -> Iterator[EmotionPrediction]:
+        """
+        Bulk scoring that yields one prediction per input, in input order.
+
+        Inputs are consumed `chunk_size` at a time; each chunk is tokenized in
+        one call, sorted by token length and cut into `batch_size` batches, so
+        a batch pads to its own longest text rather than the chunk's.
+        """
+        it = iter(texts)
+        while True:
+            chunk = [text or "" for text in itertools.islice(it, chunk_size)]
+            if not chunk:
+                return
+            ids = self.tokenize(chunk)
+            order = sorted(range(len(chunk)), key=lambda i: len(ids[i]))
+            out: List[Optional[EmotionPrediction]] = [None] * len(chunk)
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                for i, row in zip(batch, self._forward(*self._pad([ids[i] for i in batch]))):
+                    top = int(row.argmax())
+                    out[i] = EmotionPrediction(
+                        self.labels[top], float(row[top]),
+                        dict(zip(self.labels, row.tolist())) if full else None,
+                    )
+            yield from out  # type: ignore[misc]
+
+
+# ── Process-wide defaults ──────────────────────────────────────────────────
+_lock = threading.Lock()
+_engine: Optional[EmotionEngine] = None
+_batcher: Optional[InferenceBatcher[str, Tuple[str, float]]] = None
+
+def default_engine() -> EmotionEngine:
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine = EmotionEngine()
+    return _engine
+
+def default_batcher() -> InferenceBatcher[str, Tuple[str, float]]:
+    global _batcher
+    if _batcher is None:
+        with _lock:
+            if _batcher is None:
+                # Model loading happens on the batcher thread, not the caller's
+                _batcher = InferenceBatcher(
+                    lambda texts: default_engine().classify(texts),
+                    name="emotion",
+                    max_batch=int(os.getenv("EMOTION_BATCH_MAX", "32")),
+                    max_wait=float(os.getenv("EMOTION_BATCH_WAIT_MS", "5")) / 1000,
+                )
+    return _batcher
+
+def submit_emotion(text: str) -> "Future[Tuple[str, float]]":
+    """
+    Classify `text` in the next micro-batch; resolves to (label, confidence).
+    Goes to the shared model server when one is configured and reachable.
+    """
+    from model_server import get_client
+    client = get_client()
+    if client is None or not client.available():
+        return default_batcher().submit(text)
+
+    def remote() -> Tuple[str, float]:
+        results = client.call_or("classify", [text], lambda: None)
+        if results is None:
+            return default_batcher().submit(text).result()
+        label, score = results[0]
+        return label, float(score)
+    return client.submit(remote)
+
+def batcher_stats() -> dict:
+    return _batcher.stats() if _batcher is not None else {}
+
+def shutdown() -> None:
+    if _batcher is not None:
+        _batcher.close()
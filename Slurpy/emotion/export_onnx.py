@@ -0,0 +1,127 @@
+"""
+Export emotion/model to ONNX (+ dynamic int8) and check parity with eager PyTorch
+Outputs → emotion/model/onnx/model.onnx, emotion/model/onnx/model.int8.onnx
+
+Parity runs every backend over the GoEmotions validation split and reports
+label agreement and probability drift against eager fp32, plus p50/p99
+latency for single messages and batched throughput.
+
+  python -m emotion.export_onnx                 # export + parity
+  python -m emotion.export_onnx --skip-export   # parity only
+  python -m emotion.export_onnx --limit 500     # quicker parity run
+
+Serve a variant with EMOTION_BACKEND=onnx | onnx-int8 (see emotion/engine.py).
+"""
+import argparse
+import os
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
+
+from emotion.engine import MODEL_DIR, ONNX_FILES, EmotionEngine
+
+ONNX_PATH = f"{MODEL_DIR}/{ONNX_FILES['onnx']}"
+INT8_PATH = f"{MODEL_DIR}/{ONNX_FILES['onnx-int8']}"
+
+# ── 1. export ─────────────────────────────────────────────────────
+def export(model_dir: str = MODEL_DIR, onnx_path: str = ONNX_PATH, int8_path: str = INT8_PATH) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    tok = DistilBertTokenizerFast.from_pretrained(model_dir)
+    model = DistilBertForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+    model.config.return_dict = False  # plain tuple outputs trace cleanly
+
+    sample = tok(["a short example", "and a slightly longer example sentence"],
+                 return_tensors="pt", padding=True)
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            onnx_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=17,
+            do_constant_folding=True,
+        )
+    print(f"✅ ONNX export → {onnx_path} ({os.path.getsize(onnx_path) / 1e6:.1f} MB)")
+
+    # Weights → int8, activations quantized on the fly: no calibration set needed
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"✅ int8 dynamic quantization → {int8_path} ({os.path.getsize(int8_path) / 1e6:.1f} MB)")
+
+# ── 2. backends ───────────────────────────────────────────────────
+Runner = Callable[[List[str]], np.ndarray]
+
+def engine_runner(backend: str) -> Runner:
+    """Same tokenizer settings, label map and threads as the served engine."""
+    return EmotionEngine(MODEL_DIR, backend=backend).probs
+
+# ── 3. parity + latency ───────────────────────────────────────────
+def validation_texts(limit: int = 0) -> List[str]:
+    from datasets import load_dataset
+    ds = load_dataset("go_emotions", "simplified", split="validation", streaming=False)
+    texts = list(ds["text"])
+    return texts[:limit] if limit else texts
+
+def run_all(run: Runner, texts: List[str], batch_size: int) -> np.ndarray:
+    return np.concatenate([run(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+
+def latency_ms(run: Runner, texts: List[str], n: int = 200) -> Dict[str, float]:
+    samples = []
+    for text in texts[:n]:
+        t0 = time.perf_counter()
+        run([text])
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {"p50": float(np.percentile(samples, 50)), "p99": float(np.percentile(samples, 99))}
+
+def parity(texts: List[str], batch_size: int = 32) -> None:
+    runners: Dict[str, Runner] = {"eager": engine_runner("eager")}
+    for name, path in (("onnx", ONNX_PATH), ("onnx-int8", INT8_PATH)):
+        if os.path.exists(path):
+            runners[name] = engine_runner(name)
+        else:
+            print(f"⚠️ {path} missing - skipping {name}")
+
+    print(f"\n🔍 Parity on {len(texts)} GoEmotions validation texts (batch {batch_size})")
+    print(f"{'backend':<10} {'agree':>7} {'max Δp':>8} {'mean Δp':>8} {'p50 ms':>7} {'p99 ms':>7} {'texts/s':>8}")
+
+    reference = None
+    for name, run in runners.items():
+        run(texts[:batch_size])  # warm up allocator / kernels
+        t0 = time.perf_counter()
+        probs = run_all(run, texts, batch_size)
+        throughput = len(texts) / (time.perf_counter() - t0)
+        lat = latency_ms(run, texts)
+        if reference is None:
+            reference = probs
+        drift = np.abs(probs - reference)
+        agree = float((probs.argmax(axis=1) == reference.argmax(axis=1)).mean())
+        print(f"{name:<10} {agree:>7.2%} {drift.max():>8.4f} {drift.mean():>8.5f} "
+              f"{lat['p50']:>7.2f} {lat['p99']:>7.2f} {throughput:>8.1f}")
+
+# ── 4. main ───────────────────────────────────────────────────────
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--skip-export", action="store_true", help="only run the parity check")
+    ap.add_argument("--skip-parity", action="store_true", help="only export")
+    ap.add_argument("--limit", type=int, default=0, help="validation texts to use (0 = all)")
+    ap.add_argument("--batch-size", type=int, default=32)
+    args = ap.parse_args()
+
+    if not args.skip_export:
+        export()
+    if not args.skip_parity:
+        parity(validation_texts(args.limit), args.batch_size)
+
+if __name__ == "__main__":
+    main()
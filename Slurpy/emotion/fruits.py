@@ -0,0 +1,14 @@
+"""
+Emotion → fruit persona map, shared by the chat core and offline tools
+"""
+
+FRUITS = {
+    "joy": "Sunny Mango", "frustrated": "Tart Lemon", "excited": "Fizzy Orange",
+    "anxious": "Jittery Banana", "angry": "Spicy Chili", "calm": "Cool Melon",
+    "sad": "Gentle Blueberry", "hopeful": "Sweet Grape", "content": "Warm Peach",
+    "worried": "Sour Apple", "thoughtful": "Deep Plum", "proud": "Golden Apricot",
+    "neutral": "Fresh Cucumber"
+}
+
+def fruit_for(emotion: str) -> str:
+    return FRUITS.get(emotion, "Fresh Cucumber")
@@ -1,31 +1,33 @@
-import json
-import torch
-from transformers import DistilBertTokenizerFast, DistilBertForSequenceClassification
+"""
+Emotion prediction helpers — thin wrappers over the shared EmotionEngine
+(emotion/engine.py), so scripts and the chat path run the same inference.
+"""
+from typing import Iterable, Iterator, List, Tuple
 
-_MODEL = "emotion/model"
+from emotion.engine import (  # noqa: F401
+    MODEL_DIR, EmotionPrediction, default_engine, load_labels, submit_emotion,
+)
 
-_tok   = DistilBertTokenizerFast.from_pretrained(_MODEL)
-_model = DistilBertForSequenceClassification.from_pretrained(_MODEL)
-_model.eval()
+ID2LABEL = {str(i): label for i, label in enumerate(load_labels(MODEL_DIR))}
 
-with open(f"{_MODEL}/labels.json", encoding="utf-8") as f:
-    ID2LABEL = json.load(f)
-
-@torch.no_grad()
 def predict_emotion(text: str) -> str:
-    inputs = _tok(text, return_tensors="pt", truncation=True, padding=True)
-    logits = _model(**inputs).logits
-    return ID2LABEL[str(int(logits.argmax(dim=1)[0]))]
+    return default_engine().classify_one(text)[0]
 
-@torch.no_grad()
 def emotion_intensity(text: str) -> tuple[str, float]:
     """
     Returns (predicted_label, confidence_score)
     where confidence_score ∈ [0.0, 1.0].
     """
-    inputs = _tok(text, return_tensors="pt", truncation=True, padding=True)
-    logits = _model(**inputs).logits
-    probs = torch.softmax(logits, dim=1)[0]
-    idx = int(probs.argmax())
-    label = ID2LABEL[str(idx)]
-    return label, float(probs[idx])
+    return default_engine().classify_one(text)
+
+def emotion_intensity_batch(texts: List[str]) -> List[Tuple[str, float]]:
+    """emotion_intensity for many texts in one padded forward pass."""
+    return default_engine().classify(texts)
+
+def predict_emotions(texts: Iterable[str], batch_size: int = 64,
+                     return_all: bool = False) -> Iterator[EmotionPrediction]:
+    """
+    Stream predictions for many texts (lists, generators, DB cursors) in input order.
+    return_all=True also fills `.probs` with the full label distribution.
+    """
+    return default_engine().predict_stream(texts, batch_size=batch_size, full=return_all)
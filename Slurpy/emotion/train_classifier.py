@@ -1,36 +1,47 @@
 """
 Fine-tune DistilBERT on GoEmotions (remapped to custom 18-fruit-flavor emotions)
 Outputs → emotion/model/
+
+• The remapped + tokenized splits are cached under emotion/.cache, keyed by the
+  label map, tokenizer and max length — later runs skip load/filter/map/tokenize
+• group_by_length batching (less padding), configurable dataloader workers
+• Checkpoints every --save-steps; a killed run resumes from the newest one
+• Ends with a throughput summary: samples/s, tokens/s and padding ratio
+• --distill trains a smaller student against the fine-tuned teacher's soft
+  labels (→ emotion/model-distilled) and reports accuracy/F1 and p50/p99 CPU
+  latency for both; serve it with EMOTION_MODEL_DIR=emotion/model-distilled
+
+  python -m emotion.train_classifier
+  python -m emotion.train_classifier --epochs 1 --workers 4 --fresh
+  python -m emotion.train_classifier --distill --student-layers 3
 """
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
 import torch
-import os, json, numpy as np
-from datasets import load_dataset  # removed Dataset import to avoid type conflict
+import torch.nn.functional as F
+from datasets import DatasetDict, load_dataset, load_from_disk
 from transformers.training_args import TrainingArguments
 from transformers import (
+    DistilBertConfig,
     DistilBertTokenizerFast,
     DistilBertForSequenceClassification,
 )
 from transformers.trainer import Trainer
+from transformers.trainer_utils import EvalPrediction, get_last_checkpoint
 from transformers.data.data_collator import DataCollatorWithPadding
-from transformers.trainer_utils import EvalPrediction
 from evaluate import load as load_metric
 
 MODEL_DIR = "emotion/model"
-os.makedirs(MODEL_DIR, exist_ok=True)
+DISTILLED_DIR = "emotion/model-distilled"
+CACHE_DIR = "emotion/.cache"
+BASE_MODEL = "distilbert-base-uncased"
 
-# ── 1. load splits (no streaming) ────────────────────────────────
-# removed type annotation that caused Pylance conflict
-train_ds = load_dataset(
-    "go_emotions", "simplified", split="train", streaming=False
-)
-val_ds = load_dataset(
-    "go_emotions", "simplified", split="validation", streaming=False
-)
-
-# original label names
-label_names = train_ds.features["labels"].feature.names
-
-# ── 2. remap GoEmotions → 18 custom emotions ─────────────────────
+# ── 1. remap GoEmotions → custom emotions ─────────────────────────
 GO_TO_FRUIT_EMO = {
     "joy": "joy",
     "amusement": "joy",
@@ -66,53 +77,53 @@ fruit_emotions = sorted(set(GO_TO_FRUIT_EMO.values()))
 label2id = {label: i for i, label in enumerate(fruit_emotions)}
 id2label = {i: label for label, i in label2id.items()}
 
-# ── 3. filter + remap labels ─────────────────────────────────────
-def map_to_fruit_emotion(example):
-    if len(example["labels"]) != 1:
-        return None
-    original_label = label_names[example["labels"][0]]
-    mapped = GO_TO_FRUIT_EMO.get(original_label)
-    if mapped is None:
-        return None
-    example["label"] = mapped
-    return example
+# ── 2. cached, tokenized splits ──────────────────────────────────
+def dataset_cache_key(tok: DistilBertTokenizerFast, max_length: int) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(GO_TO_FRUIT_EMO, sort_keys=True).encode())
+    h.update(json.dumps(label2id, sort_keys=True).encode())
+    h.update(tok.backend_tokenizer.to_str().encode())
+    h.update(str(max_length).encode())
+    return h.hexdigest()[:16]
 
-train_ds = train_ds.map(map_to_fruit_emotion).filter(lambda x: x is not None)
-val_ds   = val_ds.map(map_to_fruit_emotion).filter(lambda x: x is not None)
+def load_splits(tok: DistilBertTokenizerFast, max_length: int, cache_dir: str = CACHE_DIR,
+                rebuild: bool = False, num_proc: int = 1) -> DatasetDict:
+    path = os.path.join(cache_dir, f"goemotions-{dataset_cache_key(tok, max_length)}")
+    if os.path.isdir(path) and not rebuild:
+        print(f"♻️ Using cached dataset → {path}")
+        return load_from_disk(path)
 
-# ── 4. tokenise ──────────────────────────────────────────────────
-tok = DistilBertTokenizerFast.from_pretrained("distilbert-base-uncased")
+    raw = DatasetDict({
+        "train": load_dataset("go_emotions", "simplified", split="train", streaming=False),
+        "validation": load_dataset("go_emotions", "simplified", split="validation", streaming=False),
+    })
+    label_names = raw["train"].features["labels"].feature.names
 
-def encode(batch):
-    return tok(batch["text"], truncation=True)
+    # Filter first: map() can't drop rows, so returning None from it never worked
+    def keep(example):
+        return len(example["labels"]) == 1 and label_names[example["labels"][0]] in GO_TO_FRUIT_EMO
 
-train_ds = train_ds.map(encode, batched=True)
-val_ds   = val_ds.map(encode, batched=True)
+    def encode(batch):
+        enc = tok(batch["text"], truncation=True, max_length=max_length)
+        enc["label"] = [label2id[GO_TO_FRUIT_EMO[label_names[ls[0]]]] for ls in batch["labels"]]
+        enc["length"] = [len(ids) for ids in enc["input_ids"]]
+        return enc
 
-# map string label → int id
-def encode_labels(example):
-    example["label"] = label2id[example["label"]]
-    return example
+    ds = raw.filter(keep, num_proc=num_proc)
+    ds = ds.map(encode, batched=True, num_proc=num_proc, remove_columns=["labels", "id"])
+    ds.save_to_disk(path)
+    print(f"💾 Cached tokenized dataset → {path}")
+    return ds
 
-train_ds = train_ds.map(encode_labels).with_format("torch")
-val_ds   = val_ds.map(encode_labels).with_format("torch")
-
-# ── 5. model ──────────────────────────────────────────────────────
-model = DistilBertForSequenceClassification.from_pretrained(
-    "distilbert-base-uncased",
-    num_labels=len(label2id),
-    id2label=id2label,
-    label2id=label2id,
-)
-
-# ── 6. metrics ───────────────────────────────────────────────────
+# ── 3. metrics ───────────────────────────────────────────────────
 metric_acc = load_metric("accuracy")
 metric_f1  = load_metric("f1")
 
 def compute_metrics(p: EvalPrediction):
     if p.label_ids is None:
         return {}
-    preds = np.argmax(p.predictions, axis=-1)
+    logits = p.predictions[0] if isinstance(p.predictions, tuple) else p.predictions
+    preds = np.argmax(logits, axis=-1)
 
     acc_res = metric_acc.compute(predictions=preds, references=p.label_ids) or {}
     f1_res  = metric_f1.compute(predictions=preds, references=p.label_ids, average="weighted") or {}
@@ -122,37 +133,235 @@ def compute_metrics(p: EvalPrediction):
         "f1":       f1_res.get("f1", 0.0),
     }
 
-# ── 7. training args ────────────────────────────────────────────
-use_fp16 = torch.cuda.is_available()
-
-args = TrainingArguments(
-    output_dir=MODEL_DIR,
-    per_device_train_batch_size=32,
-    per_device_eval_batch_size=64,
-    num_train_epochs=3,
-    eval_strategy="epoch",
-    save_strategy="epoch",
-    load_best_model_at_end=True,
-    save_total_limit=2,
-    logging_steps=100,
-    fp16=use_fp16,
-)
+# ── 4. trainer with padding accounting ───────────────────────────
+class MeteredTrainer(Trainer):
+    """Counts real vs padded tokens in the main process (collators may run in workers)."""
 
-trainer = Trainer(
-    model=model,
-    args=args,
-    train_dataset=train_ds,
-    eval_dataset=val_ds,
-    data_collator=DataCollatorWithPadding(tok),
-    compute_metrics=compute_metrics,
-)
+    real_tokens = 0
+    padded_tokens = 0
+    samples = 0
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        mask = inputs.get("attention_mask")
+        if mask is not None:
+            self.real_tokens += int(mask.sum())
+            self.padded_tokens += mask.numel()
+            self.samples += mask.shape[0]
+        return super().training_step(model, inputs, *args, **kwargs)
+
+def print_throughput(trainer: MeteredTrainer, train_metrics: dict, wall: float) -> None:
+    runtime = train_metrics.get("train_runtime") or wall
+    padding = 1 - trainer.real_tokens / trainer.padded_tokens if trainer.padded_tokens else 0.0
+    print("\n📈 Throughput summary")
+    print(f"   samples this run : {trainer.samples}")
+    print(f"   samples/s        : {trainer.samples / runtime:.1f}")
+    print(f"   tokens/s (real)  : {trainer.real_tokens / runtime:.0f}")
+    print(f"   padding ratio    : {padding:.1%}")
+    print(f"   wall time        : {wall:.0f}s")
+
+def training_args(args, output_dir: str, **overrides) -> TrainingArguments:
+    params = dict(
+        output_dir=output_dir,
+        per_device_train_batch_size=args.batch_size,
+        per_device_eval_batch_size=args.eval_batch_size,
+        num_train_epochs=args.epochs,
+        eval_strategy="steps",
+        save_strategy="steps",
+        eval_steps=args.save_steps,
+        save_steps=args.save_steps,
+        load_best_model_at_end=True,
+        metric_for_best_model="f1",
+        save_total_limit=2,
+        logging_steps=100,
+        fp16=torch.cuda.is_available(),
+        group_by_length=not args.no_group_by_length,
+        length_column_name="length",
+        dataloader_num_workers=args.workers,
+        dataloader_persistent_workers=args.workers > 0,
+    )
+    params.update(overrides)
+    return TrainingArguments(**params)
+
+def resume_checkpoint(output_dir: str, fresh: bool):
+    if fresh or not os.path.isdir(output_dir):
+        return None
+    last = get_last_checkpoint(output_dir)
+    if last:
+        print(f"♻️ Resuming from {last}")
+    return last
+
+def save_model(trainer: Trainer, tok: DistilBertTokenizerFast, output_dir: str) -> None:
+    trainer.save_model(output_dir)
+    tok.save_pretrained(output_dir)
+    with open(f"{output_dir}/labels.json", "w") as f:
+        json.dump(id2label, f)
+
+# ── 5. fine-tune ─────────────────────────────────────────────────
+def train(args) -> None:
+    os.makedirs(args.output, exist_ok=True)
+    tok = DistilBertTokenizerFast.from_pretrained(BASE_MODEL)
+    ds = load_splits(tok, args.max_length, args.cache_dir, args.rebuild_cache, args.num_proc)
+
+    model = DistilBertForSequenceClassification.from_pretrained(
+        BASE_MODEL,
+        num_labels=len(label2id),
+        id2label=id2label,
+        label2id=label2id,
+    )
+    trainer = MeteredTrainer(
+        model=model,
+        args=training_args(args, args.output),
+        train_dataset=ds["train"],
+        eval_dataset=ds["validation"],
+        data_collator=DataCollatorWithPadding(tok),
+        compute_metrics=compute_metrics,
+    )
+
+    started = time.perf_counter()
+    result = trainer.train(resume_from_checkpoint=resume_checkpoint(args.output, args.fresh))
+    save_model(trainer, tok, args.output)
+    print("✅  Fine-tune complete →", args.output)
+    print_throughput(trainer, result.metrics, time.perf_counter() - started)
+
+# ── 6. distillation ──────────────────────────────────────────────
+def build_student(teacher: DistilBertForSequenceClassification, layers: int,
+                  dim: int = 0) -> DistilBertForSequenceClassification:
+    config = DistilBertConfig.from_dict(teacher.config.to_dict())
+    config.n_layers = layers
+    if dim and dim != config.dim:
+        config.dim, config.hidden_dim, config.n_heads = dim, 4 * dim, max(1, dim // 64)
+    student = DistilBertForSequenceClassification(config)
+
+    if config.dim == teacher.config.dim:
+        # Same width: start from the teacher's embeddings, head and evenly spaced layers
+        student.distilbert.embeddings.load_state_dict(teacher.distilbert.embeddings.state_dict())
+        picks = np.linspace(0, teacher.config.n_layers - 1, layers).round().astype(int)
+        for dst, src in zip(student.distilbert.transformer.layer, picks):
+            dst.load_state_dict(teacher.distilbert.transformer.layer[int(src)].state_dict())
+        student.pre_classifier.load_state_dict(teacher.pre_classifier.state_dict())
+        student.classifier.load_state_dict(teacher.classifier.state_dict())
+    return student
+
+class DistillTrainer(MeteredTrainer):
+    """alpha · T² · KL(student_T ‖ teacher_T) + (1 − alpha) · CE(hard labels)"""
+
+    def __init__(self, *args, teacher, temperature: float = 2.0, alpha: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.to(self.args.device).eval()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        outputs = model(**inputs)
+        with torch.no_grad():
+            teacher_logits = self.teacher(input_ids=inputs["input_ids"],
+                                          attention_mask=inputs["attention_mask"]).logits
+        t = self.temperature
+        soft = F.kl_div(
+            F.log_softmax(outputs.logits / t, dim=-1),
+            F.softmax(teacher_logits / t, dim=-1),
+            reduction="batchmean",
+        ) * (t * t)
+        loss = self.alpha * soft + (1 - self.alpha) * outputs.loss
+        return (loss, outputs) if return_outputs else loss
+
+def latency_ms(model_dir: str, texts, max_length: int, n: int = 300) -> dict:
+    """Single-message CPU latency through the same engine the API serves."""
+    from emotion.engine import EmotionEngine
+    engine = EmotionEngine(model_dir, backend="eager", max_length=max_length)
+    for text in texts[:20]:
+        engine.classify_one(text)  # warm up
+    samples = []
+    for text in texts[:n]:
+        t0 = time.perf_counter()
+        engine.classify_one(text)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {"p50_ms": float(np.percentile(samples, 50)), "p99_ms": float(np.percentile(samples, 99))}
+
+def distill(args) -> None:
+    os.makedirs(args.output, exist_ok=True)
+    tok = DistilBertTokenizerFast.from_pretrained(args.teacher)
+    ds = load_splits(tok, args.max_length, args.cache_dir, args.rebuild_cache, args.num_proc)
+
+    teacher = DistilBertForSequenceClassification.from_pretrained(args.teacher)
+    student = build_student(teacher, args.student_layers, args.student_dim)
+    trainer = DistillTrainer(
+        model=student,
+        args=training_args(args, args.output),
+        train_dataset=ds["train"],
+        eval_dataset=ds["validation"],
+        data_collator=DataCollatorWithPadding(tok),
+        compute_metrics=compute_metrics,
+        teacher=teacher,
+        temperature=args.temperature,
+        alpha=args.alpha,
+    )
+
+    started = time.perf_counter()
+    result = trainer.train(resume_from_checkpoint=resume_checkpoint(args.output, args.fresh))
+    save_model(trainer, tok, args.output)
+    print("✅  Distillation complete →", args.output)
+    print_throughput(trainer, result.metrics, time.perf_counter() - started)
+
+    # ── teacher vs student report ──
+    teacher_eval = Trainer(
+        model=teacher,
+        args=training_args(args, os.path.join(args.output, "teacher-eval"), report_to=[]),
+        eval_dataset=ds["validation"],
+        data_collator=DataCollatorWithPadding(tok),
+        compute_metrics=compute_metrics,
+    ).evaluate()
+    student_eval = trainer.evaluate()
+    texts = list(ds["validation"]["text"])
+    report = {}
+    for name, model_dir, scores, model in (("teacher", args.teacher, teacher_eval, teacher),
+                                           ("student", args.output, student_eval, trainer.model)):
+        report[name] = {
+            "params_m": sum(p.numel() for p in model.parameters()) / 1e6,
+            "accuracy": scores.get("eval_accuracy", 0.0),
+            "f1": scores.get("eval_f1", 0.0),
+            **latency_ms(model_dir, texts, args.max_length),
+        }
+    with open(os.path.join(args.output, "distill_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n📊 Teacher vs student (GoEmotions validation, CPU, batch 1)")
+    print(f"{'model':<8} {'params':>8} {'acc':>7} {'F1':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, r in report.items():
+        print(f"{name:<8} {r['params_m']:>7.1f}M {r['accuracy']:>7.3f} {r['f1']:>7.3f} "
+              f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
 
-# ── 8. train & save ─────────────────────────────────────────────
-trainer.train()
-trainer.save_model(MODEL_DIR)
-tok.save_pretrained(MODEL_DIR)
+# ── 7. main ──────────────────────────────────────────────────────
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Fine-tune the Slurpy emotion classifier")
+    ap.add_argument("--output", default=None,
+                    help=f"model + checkpoint directory (default {MODEL_DIR}, {DISTILLED_DIR} with --distill)")
+    ap.add_argument("--cache-dir", default=CACHE_DIR, help="tokenized dataset cache")
+    ap.add_argument("--rebuild-cache", action="store_true", help="re-run load/filter/map/tokenize")
+    ap.add_argument("--epochs", type=float, default=3)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--eval-batch-size", type=int, default=64)
+    ap.add_argument("--max-length", type=int, default=128, help="token cap (match EMOTION_MAX_LENGTH)")
+    ap.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="dataloader workers")
+    ap.add_argument("--num-proc", type=int, default=1, help="processes for dataset preprocessing")
+    ap.add_argument("--save-steps", type=int, default=500, help="checkpoint/eval interval")
+    ap.add_argument("--no-group-by-length", action="store_true", help="random-order batches")
+    ap.add_argument("--fresh", action="store_true", help="ignore existing checkpoints")
 
-with open(f"{MODEL_DIR}/labels.json", "w") as f:
-    json.dump(id2label, f)
+    ap.add_argument("--distill", action="store_true", help="train a smaller student from --teacher")
+    ap.add_argument("--teacher", default=MODEL_DIR, help="fine-tuned teacher model dir")
+    ap.add_argument("--student-layers", type=int, default=3)
+    ap.add_argument("--student-dim", type=int, default=0, help="hidden size (0 = teacher's, copies its weights)")
+    ap.add_argument("--temperature", type=float, default=2.0)
+    ap.add_argument("--alpha", type=float, default=0.5, help="weight of the soft-label loss")
+    args = ap.parse_args(argv)
+    if args.output is None:
+        args.output = DISTILLED_DIR if args.distill else MODEL_DIR
+    return args
 
-print("✅  Fine-tune complete →", MODEL_DIR)
+if __name__ == "__main__":
+    args = parse_args()
+    if args.distill:
+        distill(args)
+    else:
+        train(args)
@@ -0,0 +1,33 @@
+"""
+gunicorn.conf.py — Prefork serving for api.py
+
+  gunicorn -c gunicorn.conf.py api:app
+
+• preload_app imports api (and rag_core / memory) once in the master, then
+  prefork.preload_models() loads the models before any worker is forked, so
+  workers share the weights copy‑on‑write instead of loading their own
+• Each worker warms up in the FastAPI lifespan before it accepts traffic and
+  logs its time‑to‑ready and unique memory (USS)
+
+Env
+- PORT             (default 8000)
+- WEB_CONCURRENCY  (workers, default 2; also splits the emotion thread budget)
+- GUNICORN_TIMEOUT (seconds, default 120)
+"""
+import os
+import time
+
+_started = time.perf_counter()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    import prefork
+    prefork.preload_models()
+    server.log.info("Master ready in %.1fs; forking %d workers", time.perf_counter() - _started, workers)
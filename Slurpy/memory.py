@@ -1,34 +1,234 @@
 """
 memory.py – Enhanced Qdrant Cloud memory system with proper type handling
+
+Importing this module does no I/O: the embedder is built on first use and
+Qdrant is connected by a background thread (connect_in_background(), called
+from the API lifespan, or the first memory call). Until the collection is
+ready the system runs degraded - writes are skipped and recall is empty - and
+the connection is retried with capped exponential backoff.
+
+Every payload carries "ts" (epoch milliseconds) under a range index, so the
+most recent memories come from a server-side order_by scroll whatever the
+user's history size; migrate_memory_ts.py backfills older points.
+
+Env
+- QDRANT_URL / QDRANT_API_KEY
+- QDRANT_TIMEOUT        (seconds per request, default 30)
+- QDRANT_RETRY_MAX      (longest wait between connection attempts, default 60s)
+- MEMORY_UPSERT_BATCH   (points per batched upsert, default 64)
+- MEMORY_UPSERT_MAX_AGE_MS (longest a new memory waits for its batch, default 1000)
+- MEMORY_WAL            (write‑ahead log prefix for buffered upserts, default
+                         memory_upserts.wal; empty disables, see upsert_buffer.py)
+- MEMORY_USER_CACHE     (true/false, default false) → per‑user in‑process vectors
+                         for recall (see user_vector_cache.py)
+- MEMORY_USER_CACHE_MB  (global budget, default 256)
+- MEMORY_USER_CACHE_MAX_POINTS (users with more memories always query Qdrant, default 5000)
+- MEMORY_USER_CACHE_TTL (seconds before a cached user is reloaded, default 300)
 """
-import uuid, datetime, os, json, hashlib
+import uuid, datetime, os, json, hashlib, threading
+from dataclasses import dataclass, field, replace
 from typing import Dict, Any, List, Optional, Tuple, Union
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue, Range
-from langchain_huggingface import HuggingFaceEmbeddings
+from qdrant_client.models import (VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue, Range,
+                                  IntegerIndexParams, IntegerIndexType, OrderBy, Direction,
+                                  IsEmptyCondition, PayloadField)
 import numpy as np
 
+from embedding_cache import EMBED_MODEL, CachedEmbeddings, cached_embedder
+from metrics import register_stats, stage
+from upsert_buffer import UpsertBuffer, claim_wal
+from user_vector_cache import UserVectorCache
+
 # ── Enhanced configuration ─────────────────────────────────────────────
 load_dotenv()
 
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API = os.getenv("QDRANT_API_KEY") 
 COLL_MEM = "user_memory_v2"  # New collection name for enhanced version
-EMBED_MODEL = "all-MiniLM-L6-v2"
 
 print(f"🔍 Memory System - QDRANT_URL: {QDRANT_URL}")
 print(f"🔍 Memory System - API Key present: {bool(QDRANT_API)}")
 
-_embedder = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "30"))
+QDRANT_RETRY_MAX = float(os.getenv("QDRANT_RETRY_MAX", "60"))
+MEMORY_UPSERT_BATCH = int(os.getenv("MEMORY_UPSERT_BATCH", "64"))
+MEMORY_UPSERT_MAX_AGE = float(os.getenv("MEMORY_UPSERT_MAX_AGE_MS", "1000")) / 1000
+MEMORY_WAL = os.getenv("MEMORY_WAL", "memory_upserts.wal")
+MEMORY_USER_CACHE = os.getenv("MEMORY_USER_CACHE", "false").lower() in {"1", "true", "yes"}
+MEMORY_USER_CACHE_MB = float(os.getenv("MEMORY_USER_CACHE_MB", "256"))
+MEMORY_USER_CACHE_MAX_POINTS = int(os.getenv("MEMORY_USER_CACHE_MAX_POINTS", "5000"))
+MEMORY_USER_CACHE_TTL = float(os.getenv("MEMORY_USER_CACHE_TTL", "300"))
+
+# Epoch milliseconds in every payload ("ts"); range-indexed so recent memories are ordered server-side
+TS_FIELD = "ts"
+TS_INDEX = IntegerIndexParams(type=IntegerIndexType.INTEGER, lookup=False, range=True)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MS = datetime.timedelta(milliseconds=1)
+
+def epoch_ms(moment: Union[datetime.datetime, str]) -> int:
+    """Epoch milliseconds for a naive-UTC datetime or its ISO string (as stored in "timestamp")"""
+    if isinstance(moment, str):
+        moment = datetime.datetime.fromisoformat(moment)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (moment - _EPOCH) // _MS
+
+def payload_ts(payload: Dict[str, Any]) -> int:
+    """A payload's epoch ms, derived from "timestamp" for points not yet migrated"""
+    ts = payload.get(TS_FIELD)
+    if isinstance(ts, int):
+        return ts
+    try:
+        return epoch_ms(payload.get("timestamp") or "")
+    except ValueError:
+        return 0
+
+_embedder: Optional[CachedEmbeddings] = None
+_embedder_lock = threading.Lock()
+
+def get_embedder() -> CachedEmbeddings:
+    """The memory embedder, built on first use"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = cached_embedder(EMBED_MODEL)
+    return _embedder
+
+def _embed_cache_stats() -> Dict[str, float]:
+    return _embedder.stats() if _embedder is not None else {}
+
+register_stats("slurpy_embed_cache", "Embedding cache", _embed_cache_stats)
+
+def embed_text(text: str) -> List[float]:
+    """Embed one text with the memory model (compute once per turn and pass it around)"""
+    with stage("memory.embed"):
+        return get_embedder().embed_query(text)
+
+def warmup_embedder() -> None:
+    """Run the embedding model once, bypassing the cache"""
+    get_embedder().inner.embed_query("warming up")
+
+@dataclass
+class MemoryHit:
+    """One recalled memory; score is 0.0 for recency-only fallback hits"""
+    text: str
+    score: float = 0.0
+    timestamp: str = ""
+    emotion: str = "neutral"
+    tags: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any], score: float = 0.0) -> "MemoryHit":
+        return cls(
+            text=payload["text"],
+            score=float(score),
+            timestamp=payload.get("timestamp", ""),
+            emotion=payload.get("emotion", "neutral"),
+            tags=list(payload.get("semantic_tags") or []),
+        )
+
+@dataclass(frozen=True)
+class RankWeights:
+    """Re-ranking knobs: final = similarity + recency·e^(−days·time_decay) + emotion − short"""
+    recency: float = 0.1            # boost for a memory from today
+    time_decay: float = 0.1         # per-day exponential decay of that boost
+    emotion: float = 0.1            # memory's emotion is named in an emotional query
+    short_penalty: float = 0.05     # memories shorter than short_length chars
+    short_length: int = 20
+    emotion_triggers: Tuple[str, ...] = ("sad", "happy", "angry", "anxious")
+
+DEFAULT_RANK_WEIGHTS = RankWeights()
 
 class MemorySystem:
     def __init__(self):
         self.client: Optional[QdrantClient] = None
         self.connected = False
         self.collection_ready = False
-        self._initialize_connection()
-    
+        self.degraded = False  # configured, but Qdrant hasn't been reachable yet
+        self.connect_attempts = 0
+        self._connector: Optional[threading.Thread] = None
+        self._connector_lock = threading.Lock()
+        self._ready_event = threading.Event()
+        self._stop = threading.Event()
+        self._buffer: Optional[UpsertBuffer] = None  # created once connected, in the serving process
+        self._user_cache: Optional[UserVectorCache] = None
+        if MEMORY_USER_CACHE:
+            self._user_cache = UserVectorCache(
+                self._load_user_points, int(MEMORY_USER_CACHE_MB * 1024 * 1024),
+                max_points=MEMORY_USER_CACHE_MAX_POINTS, ttl=MEMORY_USER_CACHE_TTL,
+            )
+
+    # ── Lifecycle ───────────────────────────────────────────────────────
+    @property
+    def ready(self) -> bool:
+        return self.connected and self.collection_ready and self.client is not None
+
+    def connect_in_background(self) -> None:
+        """Start the connector thread once; returns immediately"""
+        if self._connector is not None or self.ready:
+            return
+        if not QDRANT_URL or not QDRANT_API:
+            if not self.degraded:
+                print("⚠️ Missing QDRANT_URL or QDRANT_API_KEY - memory will be disabled")
+                self.degraded = True
+            return
+        with self._connector_lock:
+            if self._connector is None:
+                self._connector = threading.Thread(target=self._connect_loop, name="qdrant-connect", daemon=True)
+                self._connector.start()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Connect (in the background) and block until ready or timeout"""
+        self.connect_in_background()
+        return self._ready_event.wait(timeout) if self._connector is not None else self.ready
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop reconnecting and flush buffered upserts (unflushed ones stay in the WAL)"""
+        self._stop.set()
+        if self._buffer is not None:
+            self._buffer.close(timeout)
+
+    def _usable(self) -> bool:
+        """Ready for Qdrant calls; kicks off the connection on first use"""
+        if not self.ready:
+            self.connect_in_background()
+            return False
+        return True
+
+    def _connect_loop(self) -> None:
+        delay = 1.0
+        while not self._stop.is_set():
+            self.connect_attempts += 1
+            self._initialize_connection()
+            if self.ready:
+                if self._buffer is None:
+                    self._buffer = UpsertBuffer(
+                        self._upsert_points, claim_wal(MEMORY_WAL),
+                        max_points=MEMORY_UPSERT_BATCH, max_age=MEMORY_UPSERT_MAX_AGE,
+                    )
+                self.degraded = False
+                self._ready_event.set()
+                print("🎉 Enhanced Slurpy memory system is ready!")
+                return
+            if not self.degraded:
+                print("💤 Running without enhanced memory features until Qdrant is reachable")
+            self.degraded = True
+            print(f"🔁 Retrying Qdrant in {delay:.0f}s")
+            self._stop.wait(delay)
+            delay = min(delay * 2, QDRANT_RETRY_MAX)
+
+    def stats(self) -> Dict[str, float]:
+        stats = {"ready": float(self.ready), "degraded": float(self.degraded),
+                 "connect_attempts": float(self.connect_attempts)}
+        if self._buffer is not None:
+            stats.update({f"upserts_{k}": float(v) for k, v in self._buffer.stats().items()})
+        if self._user_cache is not None:
+            stats.update({f"user_cache_{k}": float(v) for k, v in self._user_cache.stats().items()})
+        return stats
+
     def _initialize_connection(self):
         """Initialize connection with robust error handling"""
         if not QDRANT_URL or not QDRANT_API:
@@ -40,7 +240,7 @@ class MemorySystem:
             self.client = QdrantClient(
                 url=QDRANT_URL,
                 api_key=QDRANT_API,
-                timeout=30,
+                timeout=QDRANT_TIMEOUT,
                 prefer_grpc=False  # Use HTTP for better compatibility
             )
             
@@ -73,7 +273,7 @@ class MemorySystem:
                 print(f"📦 Creating new collection: {COLL_MEM}")
                 
                 # Get embedding dimension
-                test_embedding = _embedder.embed_query("test")
+                test_embedding = embed_text("test")
                 embedding_dim = len(test_embedding)
                 print(f"📏 Embedding dimension: {embedding_dim}")
                 
@@ -119,6 +319,18 @@ class MemorySystem:
             # Verify collection is accessible
             collection_info = self.client.get_collection(COLL_MEM)
             print(f"📊 Collection has {collection_info.points_count} stored memories")
+            
+            # Range index on the epoch timestamp (recent memories use order_by on it)
+            if TS_FIELD not in (collection_info.payload_schema or {}):
+                try:
+                    self.client.create_payload_index(
+                        collection_name=COLL_MEM,
+                        field_name=TS_FIELD,
+                        field_schema=TS_INDEX
+                    )
+                    print(f"✅ Created range index for {TS_FIELD} field")
+                except Exception as index_error:
+                    print(f"⚠️ Could not create {TS_FIELD} index: {index_error}")
             self.collection_ready = True
             
         except Exception as e:
@@ -126,9 +338,10 @@ class MemorySystem:
             self.collection_ready = False
     
     def add_message(self, user_id: str, text: str, emotion: str, fruit: str, intensity: float, 
-                   context: Optional[Dict[str, Any]] = None) -> bool:
-        """Add a message to user's memory with enhanced metadata"""
-        if not self.connected or not self.collection_ready or self.client is None:
+                   context: Optional[Dict[str, Any]] = None,
+                   vector: Optional[List[float]] = None) -> bool:
+        """Add a message to user's memory with enhanced metadata (pass `vector` if already embedded)"""
+        if not self._usable():
             print("⚠️ Memory system not ready - skipping message storage")
             return False
         
@@ -138,8 +351,9 @@ class MemorySystem:
             # Use UUID instead of concatenated string
             point_id = str(uuid.uuid4())
             
-            # Generate embedding
-            vector = _embedder.embed_query(text)
+            # Generate embedding unless the caller already has it
+            if vector is None:
+                vector = embed_text(text)
             
             # Enhanced payload with better metadata
             payload: Dict[str, Any] = {
@@ -149,6 +363,7 @@ class MemorySystem:
                 "fruit": fruit,
                 "intensity": float(intensity),
                 "timestamp": timestamp.isoformat(),
+                TS_FIELD: epoch_ms(timestamp),
                 "date": timestamp.strftime("%Y-%m-%d"),
                 "hour": timestamp.hour,
                 "word_count": len(text.split()),
@@ -159,17 +374,12 @@ class MemorySystem:
             # Add semantic tags for better retrieval
             payload["semantic_tags"] = self._generate_semantic_tags(text, emotion)
             
-            # Create and insert point
-            point = PointStruct(
-                id=point_id,
-                vector=vector,
-                payload=payload
-            )
-            
-            result = self.client.upsert(
-                collection_name=COLL_MEM,
-                points=[point]
-            )
+            # Buffer the point; it goes out with the next batched upsert
+            if self._buffer is None or not self._buffer.add(point_id, list(vector), payload):
+                print("⚠️ Memory upsert buffer full - skipping message storage")
+                return False
+            if self._user_cache is not None:
+                self._user_cache.append(user_id, point_id, vector, payload)
             
             print(f"💾 Stored memory for user {user_id[:8]}... (ID: {point_id})")
             return True
@@ -178,6 +388,48 @@ class MemorySystem:
             print(f"⚠️ Failed to add message: {e}")
             return False
     
+    def _upsert_points(self, batch: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+        """One batched upsert; Qdrant acknowledges receipt without waiting for indexing"""
+        if self.client is None:
+            raise RuntimeError("Qdrant client not connected")
+        with stage("memory.upsert"):
+            self.client.upsert(
+                collection_name=COLL_MEM,
+                points=[PointStruct(id=pid, vector=vec, payload=payload) for pid, vec, payload in batch],
+                wait=False,
+            )
+    
+    def _load_user_points(self, user_id: str, max_points: int) -> Optional[List[Tuple[str, List[float], Dict[str, Any]]]]:
+        """All of a user's points with vectors, or None when they have more than max_points"""
+        if self.client is None:
+            raise RuntimeError("Qdrant client not connected")
+        user_filter = Filter(must=[FieldCondition(key="user_id", match=MatchValue(value=user_id))])
+        with stage("memory.cache_load"):
+            if self.client.count(COLL_MEM, count_filter=user_filter, exact=True).count > max_points:
+                return None
+            points: List[Tuple[str, List[float], Dict[str, Any]]] = []
+            offset = None
+            while True:
+                page, offset = self.client.scroll(
+                    collection_name=COLL_MEM,
+                    scroll_filter=user_filter,
+                    limit=256,
+                    offset=offset,
+                    with_payload=["text", "emotion", "timestamp", TS_FIELD, "semantic_tags"],
+                    with_vectors=True
+                )
+                points += [(str(p.id), list(p.vector), {**(p.payload or {}), TS_FIELD: payload_ts(p.payload or {})})
+                           for p in page if p.payload and p.payload.get("text") and p.vector]
+                if offset is None:
+                    break
+        # Buffered points may not be visible to the scroll yet
+        seen = {pid for pid, _, _ in points}
+        points += [p for p in self._pending_points(user_id) if p[0] not in seen]
+        return points
+    
+    def _pending_points(self, user_id: str) -> List[Tuple[str, List[float], Dict[str, Any]]]:
+        return self._buffer.pending(user_id) if self._buffer is not None else []
+    
     def _generate_semantic_tags(self, text: str, emotion: str) -> List[str]:
         """Generate semantic tags for better search"""
         tags = [emotion]
@@ -210,33 +462,40 @@ class MemorySystem:
         
         return list(set(tags))  # Remove duplicates
     
-    def recall(self, user_id: str, query: str, k: int = 5, 
-               time_weight: float = 0.1, emotion_match: bool = False) -> List[str]:
-        """Enhanced recall with multiple search strategies"""
-        if not self.connected or not self.collection_ready or self.client is None:
+    def retrieve(self, user_id: str, query: str, k: int = 5,
+                 time_weight: Optional[float] = None,
+                 query_vector: Optional[List[float]] = None,
+                 weights: Optional[RankWeights] = None) -> List[MemoryHit]:
+        """One search + re-rank for a turn; falls back to the most recent memories
+        (`time_weight`, if given, overrides weights.time_decay)"""
+        if not self._usable():
             print("⚠️ Memory system not ready - no recall available")
             return []
         
         try:
             # Strategy 1: Semantic similarity search with user filter
-            memories = self._semantic_search(user_id, query, k * 2)  # Get more candidates
+            memories = self._semantic_search(user_id, query, k * 2, query_vector)  # Get more candidates
             
             if memories:
                 # Strategy 2: Re-rank by relevance and recency
-                ranked_memories = self._rank_memories(memories, query, time_weight)
+                weights = weights or DEFAULT_RANK_WEIGHTS
+                if time_weight is not None:
+                    weights = replace(weights, time_decay=time_weight)
+                with stage("memory.rank"):
+                    ranked_memories = self._rank_memories(memories, query, weights, k)
                 
-                # Return top k
-                result = [mem["text"] for mem in ranked_memories[:k]]
-                print(f"🧠 Recalled {len(result)} memories for user {user_id[:8]}...")
-                return result
+                hits = [MemoryHit.from_payload(mem, mem.get("final_score", 0.0))
+                        for mem in ranked_memories]
+                print(f"🧠 Recalled {len(hits)} memories for user {user_id[:8]}...")
+                return hits
             
             # Fallback: Get recent memories if no semantic matches
             print(f"🔄 No semantic matches, trying recent memories...")
-            recent_memories = self._get_recent_memories(user_id, k)
+            recent = [MemoryHit.from_payload(mem) for mem in self._recent_payloads(user_id, k)]
             
-            if recent_memories:
-                print(f"📚 Found {len(recent_memories)} recent memories")
-                return recent_memories
+            if recent:
+                print(f"📚 Found {len(recent)} recent memories")
+                return recent
             
             print(f"💭 No memories found for user {user_id[:8]}...")
             return []
@@ -245,36 +504,65 @@ class MemorySystem:
             print(f"⚠️ Recall failed: {e}")
             return []
     
-    def _semantic_search(self, user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
-        """Semantic search with user filtering and fallback strategies"""
+    def recall(self, user_id: str, query: str, k: int = 5, 
+               time_weight: Optional[float] = None, emotion_match: bool = False,
+               query_vector: Optional[List[float]] = None) -> List[str]:
+        """Enhanced recall with multiple search strategies (texts only)"""
+        return [hit.text for hit in self.retrieve(user_id, query, k, time_weight, query_vector)]
+    
+    def _semantic_search(self, user_id: str, query: str, limit: int,
+                         query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Qdrant search merged with this user's not-yet-searchable buffered memories"""
         if self.client is None:
             return []
-            
+        if query_vector is None:
+            query_vector = embed_text(query)
+        
+        if self._user_cache is not None:
+            cached = self._user_cache.search(user_id, query_vector, limit)
+            if cached is not None:
+                return cached  # appended on add, so buffered points are already in it
+        
+        memories = self._qdrant_search(user_id, query_vector, limit)
+        pending = self._pending_points(user_id)
+        if pending:
+            seen = {m.get("id") for m in memories}
+            vectors = np.asarray([vec for _, vec, _ in pending], dtype=np.float32)
+            q = np.asarray(query_vector, dtype=np.float32)
+            sims = vectors @ q / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(q) + 1e-12)
+            for (pid, _, payload), sim in zip(pending, sims):
+                if pid not in seen and sim >= 0.3 and payload.get("text"):
+                    memories.append({**payload, "id": pid, "similarity_score": float(sim)})
+            memories.sort(key=lambda m: m["similarity_score"], reverse=True)
+        return memories[:limit]
+    
+    def _qdrant_search(self, user_id: str, query_vector: List[float], limit: int) -> List[Dict[str, Any]]:
+        """Semantic search with user filtering and fallback strategies"""
         try:
-            query_vector = _embedder.embed_query(query)
-            
             # Try search with user filter first
             try:
-                search_result = self.client.search(
-                    collection_name=COLL_MEM,
-                    query_vector=query_vector,
-                    query_filter=Filter(
-                        must=[
-                            FieldCondition(
-                                key="user_id",
-                                match=MatchValue(value=user_id)
-                            )
-                        ]
-                    ),
-                    limit=limit,
-                    with_payload=True,
-                    score_threshold=0.3
-                )
+                with stage("memory.search"):
+                    search_result = self.client.search(
+                        collection_name=COLL_MEM,
+                        query_vector=query_vector,
+                        query_filter=Filter(
+                            must=[
+                                FieldCondition(
+                                    key="user_id",
+                                    match=MatchValue(value=user_id)
+                                )
+                            ]
+                        ),
+                        limit=limit,
+                        with_payload=True,
+                        score_threshold=0.3
+                    )
                 
                 memories = []
                 for hit in search_result:
                     if hit.payload and hit.payload.get("text"):
                         memory = dict(hit.payload)
+                        memory["id"] = str(hit.id)
                         memory["similarity_score"] = hit.score
                         memories.append(memory)
                 
@@ -285,13 +573,14 @@ class MemorySystem:
                 
                 # Fallback: Search all and filter manually
                 print("🔄 Trying manual filtering...")
-                search_result = self.client.search(
-                    collection_name=COLL_MEM,
-                    query_vector=query_vector,
-                    limit=limit * 3,  # Get more to filter
-                    with_payload=True,
-                    score_threshold=0.3
-                )
+                with stage("memory.search"):
+                    search_result = self.client.search(
+                        collection_name=COLL_MEM,
+                        query_vector=query_vector,
+                        limit=limit * 3,  # Get more to filter
+                        with_payload=True,
+                        score_threshold=0.3
+                    )
                 
                 memories = []
                 for hit in search_result:
@@ -299,6 +588,7 @@ class MemorySystem:
                         hit.payload.get("text") and 
                         hit.payload.get("user_id") == user_id):
                         memory = dict(hit.payload)
+                        memory["id"] = str(hit.id)
                         memory["similarity_score"] = hit.score
                         memories.append(memory)
                         if len(memories) >= limit:
@@ -312,82 +602,114 @@ class MemorySystem:
     
     def _get_recent_memories(self, user_id: str, limit: int) -> List[str]:
         """Get recent memories for a user"""
+        return [mem["text"] for mem in self._recent_payloads(user_id, limit)]
+    
+    def _recent_payloads(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Payloads of a user's most recent memories, newest first"""
         if self.client is None:
             return []
-            
+        if self._user_cache is not None:
+            cached = self._user_cache.recent(user_id, limit)
+            if cached is not None:
+                return cached
+            
+        user_filter = Filter(
+            must=[
+                FieldCondition(
+                    key="user_id",
+                    match=MatchValue(value=user_id)
+                )
+            ]
+        )
         try:
-            # Scroll through user's memories
-            scroll_result = self.client.scroll(
-                collection_name=COLL_MEM,
-                scroll_filter=Filter(
-                    must=[
-                        FieldCondition(
-                            key="user_id",
-                            match=MatchValue(value=user_id)
+            # Newest first, ordered by Qdrant on the range-indexed epoch timestamp
+            with stage("memory.scroll"):
+                try:
+                    points, _ = self.client.scroll(
+                        collection_name=COLL_MEM,
+                        scroll_filter=user_filter,
+                        limit=limit,
+                        order_by=OrderBy(key=TS_FIELD, direction=Direction.DESC),
+                        with_payload=True
+                    )
+                except Exception as order_error:
+                    # No ts index yet (run migrate_memory_ts.py): best effort over a page of points
+                    print(f"⚠️ Ordered scroll failed ({order_error}) - sorting a page client-side")
+                    points, _ = self.client.scroll(
+                        collection_name=COLL_MEM,
+                        scroll_filter=user_filter,
+                        limit=limit * 3,
+                        with_payload=True
+                    )
+                else:
+                    if len(points) < limit:
+                        # order_by skips points without ts (written before the migration)
+                        legacy, _ = self.client.scroll(
+                            collection_name=COLL_MEM,
+                            scroll_filter=Filter(
+                                must=user_filter.must + [IsEmptyCondition(is_empty=PayloadField(key=TS_FIELD))]
+                            ),
+                            limit=limit * 3,
+                            with_payload=True
                         )
-                    ]
-                ),
-                limit=limit * 3,  # Get more to sort by time
-                with_payload=True
-            )
-            
-            memories = []
-            for point in scroll_result[0]:
-                if point.payload and point.payload.get("text"):
-                    memories.append({
-                        "text": point.payload["text"],
-                        "timestamp": point.payload.get("timestamp", ""),
-                        "emotion": point.payload.get("emotion", "neutral")
-                    })
+                        points = list(points) + list(legacy)
             
-            # Sort by timestamp (most recent first)
-            memories.sort(key=lambda x: x["timestamp"], reverse=True)
+            memories = [dict(point.payload) for point in points
+                        if point.payload and point.payload.get("text")]
+            seen = {str(point.id) for point in points}
+            memories += [dict(payload) for pid, _, payload in self._pending_points(user_id)
+                         if pid not in seen and payload.get("text")]
             
-            return [mem["text"] for mem in memories[:limit]]
+            memories.sort(key=payload_ts, reverse=True)
+            return memories[:limit]
             
         except Exception as e:
             print(f"⚠️ Recent memories fetch failed: {e}")
             return []
     
-    def _rank_memories(self, memories: List[Dict[str, Any]], query: str, time_weight: float) -> List[Dict[str, Any]]:
-        """Rank memories by relevance, recency, and other factors"""
+    def _rank_memories(self, memories: List[Dict[str, Any]], query: str,
+                       weights: RankWeights = DEFAULT_RANK_WEIGHTS,
+                       k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Top-k memories by relevance, recency and emotion, scored as arrays (sets "final_score")"""
         if not memories:
             return []
+        n = len(memories)
         
-        current_time = datetime.datetime.utcnow()
+        similarity = np.fromiter((m.get("similarity_score", 0.0) for m in memories), np.float64, n)
+        ts = np.fromiter((payload_ts(m) for m in memories), np.int64, n)
+        lengths = np.fromiter((len(m.get("text", "")) for m in memories), np.int64, n)
+        emotions, emotion_codes = np.unique([(m.get("emotion") or "").lower() for m in memories],
+                                            return_inverse=True)
         
-        for memory in memories:
-            score = memory.get("similarity_score", 0.0)
-            
-            # Time decay factor
-            try:
-                mem_time = datetime.datetime.fromisoformat(memory["timestamp"].replace("Z", "+00:00"))
-                days_ago = (current_time - mem_time).days
-                time_factor = np.exp(-days_ago * time_weight)  # Exponential decay
-                score += time_factor * 0.1  # Small boost for recent memories
-            except:
-                pass
-            
-            # Emotional relevance boost
-            query_lower = query.lower()
-            mem_emotion = memory.get("emotion", "").lower()
-            if any(emo_word in query_lower for emo_word in ["sad", "happy", "angry", "anxious"]):
-                if mem_emotion in query_lower:
-                    score += 0.1
-            
-            # Length penalty for very short memories
-            text_length = len(memory.get("text", ""))
-            if text_length < 20:
-                score -= 0.05
-            
-            memory["final_score"] = score
+        # Recency: whole days elapsed, exponential decay (no boost without a timestamp)
+        now_ms = epoch_ms(datetime.datetime.utcnow())
+        days = np.floor_divide(now_ms - ts, 86_400_000)
+        scores = similarity + np.where(ts > 0, weights.recency * np.exp(-days * weights.time_decay), 0.0)
+        
+        # Emotion: an emotional query that names the memory's emotion (checked once per distinct emotion)
+        query_lower = query.lower()
+        if any(word in query_lower for word in weights.emotion_triggers):
+            named = np.array([bool(e) and e in query_lower for e in emotions])
+            scores += np.where(named[emotion_codes], weights.emotion, 0.0)
+        
+        scores -= np.where(lengths < weights.short_length, weights.short_penalty, 0.0)
+        
+        if k is not None and k < n:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(-scores[top], kind="stable")]
         
-        # Sort by final score
-        return sorted(memories, key=lambda x: x.get("final_score", 0), reverse=True)
+        ranked = []
+        for idx in top:
+            memory = memories[int(idx)]
+            memory["final_score"] = float(scores[idx])
+            ranked.append(memory)
+        return ranked
     
     def get_user_insights(self, user_id: str) -> Dict[str, Any]:
         """Get insights about a user's conversation patterns"""
-        if not self.connected or not self.collection_ready or self.client is None:
+        if not self._usable():
             return {}
         
         try:
@@ -498,7 +820,7 @@ class MemorySystem:
     
     def search_by_theme(self, user_id: str, theme: str, limit: int = 5) -> List[str]:
         """Search memories by specific theme/topic"""
-        if not self.connected or not self.collection_ready or self.client is None:
+        if not self._usable():
             return []
         
         try:
@@ -534,7 +856,7 @@ class MemorySystem:
     
     def get_conversation_context(self, user_id: str, current_message: str) -> str:
         """Get relevant conversation context for the current message"""
-        if not self.connected or not self.collection_ready:
+        if not self._usable():
             return ""
         
         try:
@@ -565,18 +887,43 @@ class MemorySystem:
             print(f"⚠️ Context retrieval failed: {e}")
             return ""
 
-# Initialize global memory system
+# Global memory system (connects in the background, see connect_in_background)
 _memory_system = MemorySystem()
+register_stats("slurpy_memory", "Qdrant memory system", _memory_system.stats)
+
+def connect_in_background() -> None:
+    """Start connecting to Qdrant without blocking (call at startup)"""
+    _memory_system.connect_in_background()
+
+def flush_memory(timeout: float = 10.0) -> None:
+    """Send buffered memory upserts and stop (call on shutdown)"""
+    _memory_system.close(timeout)
+
+def memory_ready() -> bool:
+    """True once Qdrant is connected and the collection is set up"""
+    return _memory_system.ready
 
 # Public API functions (maintaining compatibility with existing code)
 def add_message(user_id: str, text: str, emotion: str, fruit: str, intensity: float, 
-               context: Optional[Dict[str, Any]] = None) -> bool:
+               context: Optional[Dict[str, Any]] = None,
+               vector: Optional[List[float]] = None) -> bool:
     """Add a message to user's memory"""
-    return _memory_system.add_message(user_id, text, emotion, fruit, intensity, context)
+    return _memory_system.add_message(user_id, text, emotion, fruit, intensity, context, vector)
 
-def recall(user_id: str, query: str, k: int = 5) -> List[str]:
+def memory_enabled() -> bool:
+    """True when Qdrant is configured (writes failing then means it is down, not disabled)"""
+    return bool(QDRANT_URL and QDRANT_API)
+
+def recall(user_id: str, query: str, k: int = 5,
+           query_vector: Optional[List[float]] = None) -> List[str]:
     """Recall relevant memories for a user"""
-    return _memory_system.recall(user_id, query, k)
+    return _memory_system.recall(user_id, query, k, query_vector=query_vector)
+
+def retrieve(user_id: str, query: str, k: int = 5,
+             query_vector: Optional[List[float]] = None,
+             weights: Optional[RankWeights] = None) -> List[MemoryHit]:
+    """Recall relevant memories for a user as structured hits"""
+    return _memory_system.retrieve(user_id, query, k, query_vector=query_vector, weights=weights)
 
 def get_user_insights(user_id: str) -> Dict[str, Any]:
     """Get insights about a user's patterns"""
@@ -590,24 +937,15 @@ def get_conversation_context(user_id: str, current_message: str) -> str:
     """Get conversation context for current message"""
     return _memory_system.get_conversation_context(user_id, current_message)
 
-# Test the system
-if _memory_system.connected and _memory_system.collection_ready:
-    print("🎉 Enhanced Slurpy memory system is ready!")
-    print("✅ Features available:")
-    print("  - Semantic memory search")
-    print("  - Conversation context tracking") 
-    print("  - User insight analytics")
-    print("  - Theme-based memory retrieval")
-    print("  - Temporal memory ranking")
-else:
-    print("💤 Running without enhanced memory features")
-
 # Example usage and testing
 if __name__ == "__main__":
     # Test the memory system
     test_user = "test_user_123"
     
     print("\n🧪 Testing memory system...")
+    if not _memory_system.wait_ready(timeout=60):
+        print("❌ Qdrant not reachable - nothing to test")
+        raise SystemExit(1)
     
     # Add some test memories
     test_memories = [
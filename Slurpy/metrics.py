@@ -0,0 +1,275 @@
+"""
+metrics.py — Lightweight Prometheus metrics + per‑request stage timings
+
+• Counter / Gauge / Histogram with labels, rendered in Prometheus text format
+• stage("memory.search") times a block; inside a request the timing is kept on
+  the request and folded into `slurpy_stage_seconds{stage,mode,path}` by
+  finish_turn(), outside one it is recorded directly with path="background"
+• The same per‑request timings feed the `Server-Timing` response header
+
+Env
+- METRICS_ENABLED (true/false) → false turns every hook into a no‑op
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in {"1", "true", "yes"}
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Metric types
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not ENABLED:
+            return
+        self._observe(self._key(labels), value)
+
+    def _observe(self, key: LabelValues, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c), s[0]) for k, (c, s) in self._values.items()]
+        lines: List[str] = []
+        for key, counts, total in items:
+            running = 0
+            for bound, count in zip(self.buckets, counts):
+                running += count
+                le = _fmt_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {running}")
+            running += counts[-1]
+            inf = _fmt_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {running}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {running}")
+        return lines
+
+class _StatsCollector:
+    """Exposes a component's stats() dict as gauges, read at scrape time."""
+
+    def __init__(self, prefix: str, help: str, fn: Callable[[], Dict[str, float]]):
+        self.prefix = prefix
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            stats = self.fn()
+        except Exception as e:
+            print(f"⚠️ Metrics collector {self.prefix} failed: {e}")
+            return []
+        lines: List[str] = []
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{key}"
+            lines += [f"# HELP {name} {self.help} ({key})", f"# TYPE {name} gauge",
+                      f"{name} {_fmt_value(value)}"]
+        return lines
+
+REGISTRY: List = []
+
+def register_stats(prefix: str, help: str, fn: Callable[[], Dict[str, float]]) -> None:
+    REGISTRY.append(_StatsCollector(prefix, help, fn))
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Chat pipeline metrics
+STAGE_SECONDS = Histogram(
+    "slurpy_stage_seconds", "Latency of one chat pipeline stage",
+    ("stage", "mode", "path"),
+)
+TURN_SECONDS = Histogram(
+    "slurpy_turn_seconds", "End-to-end latency of a chat turn",
+    ("mode", "path"),
+)
+TURNS_TOTAL = Counter(
+    "slurpy_turns_total", "Chat turns by mode and path", ("mode", "path"),
+)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Per-request stage timings
+class RequestTimings:
+    __slots__ = ("stages", "flushed")
+
+    def __init__(self) -> None:
+        self.stages: List[Tuple[str, float]] = []
+        self.flushed = 0
+
+    def server_timing(self) -> str:
+        """`Server-Timing` header value; repeated stages are summed."""
+        totals: Dict[str, float] = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "slurpy_request_timings", default=None
+)
+
+def begin_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+@contextmanager
+def _timed_stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _current.get()
+        if timings is not None:
+            timings.stages.append((name, elapsed))
+        else:
+            STAGE_SECONDS._observe((name, "none", "background"), elapsed)
+
+_NOOP = nullcontext()
+
+def stage(name: str):
+    """Time a block as pipeline stage `name`."""
+    if not ENABLED:
+        return _NOOP
+    return _timed_stage(name)
+
+def timed(name: str):
+    """Decorator form of stage()."""
+    def wrap(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with _timed_stage(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+def finish_turn(mode: str, path: str, seconds: float) -> None:
+    """Fold this request's stage timings into the histograms under (mode, path)."""
+    if not ENABLED:
+        return
+    TURN_SECONDS._observe((mode, path), seconds)
+    TURNS_TOTAL.inc(mode=mode, path=path)
+    timings = _current.get()
+    if timings is None:
+        return
+    for name, elapsed in timings.stages[timings.flushed:]:
+        STAGE_SECONDS._observe((name, mode, path), elapsed)
+    timings.flushed = len(timings.stages)
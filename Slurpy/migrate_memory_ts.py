@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+migrate_memory_ts.py — One-off backfill of the epoch "ts" field in user memories
+
+• Creates the range index on "ts" if the collection doesn't have it yet
+• Scrolls user_memory_v2 in pages (payload "timestamp" / "ts" only, no vectors)
+  and sets ts = epoch milliseconds of the ISO "timestamp" on every point
+  missing it, one batch_update_points request per page
+• Idempotent: points that already have ts are skipped, so an interrupted run
+  is simply started again
+• Points without a parseable timestamp are counted and left alone (they
+  won't appear in recency-ordered scrolls)
+
+  python migrate_memory_ts.py --dry-run
+  python migrate_memory_ts.py
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from memory import COLL_MEM, TS_FIELD, TS_INDEX, epoch_ms
+
+load_dotenv()
+
+
+def main() -> None:
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import SetPayload, SetPayloadOperation
+
+    parser = argparse.ArgumentParser(description="Backfill the epoch ts payload field in Qdrant memories")
+    parser.add_argument("--collection", default=COLL_MEM)
+    parser.add_argument("--page-size", type=int, default=1000, help="points per scroll/update request")
+    parser.add_argument("--dry-run", action="store_true", help="count what would change, write nothing")
+    args = parser.parse_args()
+
+    url, api_key = os.getenv("QDRANT_URL"), os.getenv("QDRANT_API_KEY")
+    if not url or not api_key:
+        raise SystemExit("❌ Missing QDRANT_URL or QDRANT_API_KEY")
+    client = QdrantClient(url=url, api_key=api_key, timeout=60, prefer_grpc=False)
+
+    info = client.get_collection(args.collection)
+    print(f"📊 {args.collection}: {info.points_count} points")
+    if TS_FIELD not in (info.payload_schema or {}) and not args.dry_run:
+        client.create_payload_index(collection_name=args.collection, field_name=TS_FIELD,
+                                    field_schema=TS_INDEX, wait=True)
+        print(f"✅ Created range index for {TS_FIELD}")
+
+    started = time.perf_counter()
+    scanned = updated = unparseable = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=args.collection, limit=args.page_size, offset=offset,
+            with_payload=["timestamp", TS_FIELD], with_vectors=False,
+        )
+        scanned += len(points)
+        operations = []
+        for p in points:
+            payload = p.payload or {}
+            if isinstance(payload.get(TS_FIELD), int):
+                continue
+            try:
+                ts = epoch_ms(payload.get("timestamp") or "")
+            except ValueError:
+                unparseable += 1
+                continue
+            operations.append(SetPayloadOperation(set_payload=SetPayload(payload={TS_FIELD: ts}, points=[p.id])))
+        if operations and not args.dry_run:
+            client.batch_update_points(collection_name=args.collection, update_operations=operations, wait=True)
+        updated += len(operations)
+        print(f"   {scanned} scanned, {updated} {'to backfill' if args.dry_run else 'backfilled'}")
+        if offset is None:
+            break
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {args.collection}: {updated} of {scanned} points {'need' if args.dry_run else 'got'} {TS_FIELD} "
+          f"in {elapsed:.1f}s ({unparseable} without a usable timestamp)")
+
+
+if __name__ == "__main__":
+    main()
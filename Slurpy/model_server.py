@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+model_server.py — Local inference service shared by all API workers
+
+• Hosts the emotion classifier and the sentence embedder once per pod and
+  serves `classify` / `embed` over a unix socket
+• Requests from every worker land in the same micro‑batchers, so N workers
+  share one set of weights, one set of torch threads and larger batches
+• Wire format: 4‑byte big‑endian length + UTF‑8 JSON, both directions
+    → {"op": "classify" | "embed" | "stats" | "ping", "texts": [...], "model": "..."}
+    ← {"ok": true, "results": [...]}  |  {"ok": false, "error": "..."}
+• Client side (get_client / RemoteEmbeddings): when MODEL_SERVER_SOCKET is
+  unset or the server is unreachable, calls fall back to in‑process models
+  (loaded lazily, only if ever needed) and the server is retried after a backoff
+
+  python model_server.py --socket /tmp/slurpy-models.sock
+
+Env
+- MODEL_SERVER_SOCKET   (path)     → enables the client in API workers
+- MODEL_SERVER_TIMEOUT  (seconds)  → per‑request socket timeout (default 5)
+- MODEL_SERVER_BACKOFF  (seconds)  → how long to stay on the fallback after a failure (default 5)
+- MODEL_CLIENT_THREADS  (int)      → client threads for non‑blocking submits (default 8)
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+R = TypeVar("R")
+
+SOCKET_PATH = os.getenv("MODEL_SERVER_SOCKET", "")
+TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", "5"))
+BACKOFF = float(os.getenv("MODEL_SERVER_BACKOFF", "5"))
+CLIENT_THREADS = int(os.getenv("MODEL_CLIENT_THREADS", "8"))
+
+_HEADER = struct.Struct(">I")
+MAX_MESSAGE = 64 * 1024 * 1024
+
+
+class ModelServerUnavailable(Exception):
+    """The server could not be reached or failed the request; use the local fallback."""
+
+
+# ── framing ─────────────────────────────────────────────────────────────────
+def _encode(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("model server closed the connection")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+# ── client ──────────────────────────────────────────────────────────────────
+class ModelClient:
+    def __init__(self, path: str, timeout: float = TIMEOUT, backoff: float = BACKOFF,
+                 threads: int = CLIENT_THREADS):
+        self.path = path
+        self.timeout = timeout
+        self.backoff = backoff
+        self._local = threading.local()  # one connection per calling thread
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="model-client")
+        self._down_until = 0.0
+        self._down_logged = False
+
+        self.remote_calls = 0
+        self.fallbacks = 0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def call(self, op: str, texts: List[str], **extra: Any) -> List[Any]:
+        """One round trip; raises ModelServerUnavailable on any transport or server error."""
+        if not self.available():
+            raise ModelServerUnavailable("model server in backoff")
+        try:
+            sock = self._connection()
+            sock.sendall(_encode({"op": op, "texts": texts, **extra}))
+            (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+            reply = json.loads(_recv_exact(sock, size))
+        except (OSError, ConnectionError, ValueError) as e:
+            self._drop_connection()
+            self._mark_down(e)
+            raise ModelServerUnavailable(str(e)) from e
+        if not reply.get("ok"):
+            raise ModelServerUnavailable(reply.get("error", "model server error"))
+        if self._down_logged:
+            print(f"✅ Model server back at {self.path}")
+            self._down_logged = False
+        self.remote_calls += 1
+        return reply["results"]
+
+    def _mark_down(self, error: Exception) -> None:
+        self._down_until = time.monotonic() + self.backoff
+        if not self._down_logged:
+            print(f"⚠️ Model server {self.path} unreachable ({error}) - using in-process models")
+            self._down_logged = True
+
+    def call_or(self, op: str, texts: List[str], fallback: Callable[[], R], **extra: Any) -> R:
+        try:
+            return self.call(op, texts, **extra)  # type: ignore[return-value]
+        except ModelServerUnavailable:
+            self.fallbacks += 1
+            return fallback()
+
+    def submit(self, fn: Callable[[], R]) -> "Future[R]":
+        """Run a blocking round trip (fn) on the client's thread pool."""
+        return self._pool.submit(fn)
+
+    def stats(self) -> Dict[str, float]:
+        return {"remote_calls": self.remote_calls, "fallbacks": self.fallbacks,
+                "available": 1.0 if self.available() else 0.0}
+
+
+_client: Optional[ModelClient] = None
+_client_lock = threading.Lock()
+
+def get_client() -> Optional[ModelClient]:
+    """The process‑wide client, or None when MODEL_SERVER_SOCKET is unset."""
+    global _client
+    if not SOCKET_PATH:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ModelClient(SOCKET_PATH)
+    return _client
+
+
+class RemoteEmbeddings:
+    """LangChain‑style embedder served by the model server, with a lazy local fallback."""
+
+    def __init__(self, client: ModelClient, model_name: str, local_factory: Callable[[], Any]):
+        self.client = client
+        self.model_name = model_name
+        self._local_factory = local_factory
+        self._local: Any = None
+        self._local_lock = threading.Lock()
+
+    def _fallback(self) -> Any:
+        if self._local is None:
+            with self._local_lock:
+                if self._local is None:
+                    self._local = self._local_factory()
+        return self._local
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.call_or("embed", list(texts),
+                                   lambda: self._fallback().embed_documents(list(texts)),
+                                   model=self.model_name)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# ── server ──────────────────────────────────────────────────────────────────
+class ModelServer:
+    def __init__(self, embed_model: str):
+        from emotion.batcher import InferenceBatcher
+        from emotion.engine import default_batcher, default_engine
+        from embedding_cache import cached_embedder
+
+        started = time.perf_counter()
+        default_engine()  # load before accepting connections
+        self.emotion = default_batcher()
+        self.embed_model = embed_model
+        self.embedder = cached_embedder(embed_model, remote=False)
+        self.embed = InferenceBatcher(self.embedder.embed_documents, name="embed",
+                                      max_batch=int(os.getenv("EMBED_BATCH_MAX", "64")),
+                                      max_wait=float(os.getenv("EMBED_BATCH_WAIT_MS", "5")) / 1000)
+        print(f"✅ Models loaded in {time.perf_counter() - started:.1f}s")
+
+    async def _gather(self, batcher, texts: List[str]) -> List[Any]:
+        return list(await asyncio.gather(*(asyncio.wrap_future(batcher.submit(t)) for t in texts)))
+
+    async def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get("op")
+        texts = [str(t) for t in request.get("texts") or []]
+        if op == "classify":
+            return {"ok": True, "results": [list(r) for r in await self._gather(self.emotion, texts)]}
+        if op == "embed":
+            model = request.get("model")
+            if model and model != self.embed_model:
+                return {"ok": False, "error": f"server embeds with {self.embed_model}, not {model}"}
+            return {"ok": True, "results": await self._gather(self.embed, texts)}
+        if op == "stats":
+            return {"ok": True, "results": [{"emotion": self.emotion.stats(), "embed": self.embed.stats(),
+                                             "embed_cache": self.embedder.stats()}]}
+        if op == "ping":
+            return {"ok": True, "results": []}
+        return {"ok": False, "error": f"unknown op {op!r}"}
+
+    async def connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                except asyncio.IncompleteReadError:
+                    return  # client went away
+                if size > MAX_MESSAGE:
+                    writer.write(_encode({"ok": False, "error": "message too large"}))
+                    return
+                try:
+                    reply = await self.handle(json.loads(await reader.readexactly(size)))
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                writer.write(_encode(reply))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)  # stale socket from a previous run
+        server = await asyncio.start_unix_server(self.connection, path=path)
+        os.chmod(path, 0o660)
+        print(f"🚀 Model server listening on {path}")
+        async with server:
+            await server.serve_forever()
+
+
+def main() -> None:
+    from embedding_cache import EMBED_MODEL
+
+    parser = argparse.ArgumentParser(description="Shared emotion + embedding inference server")
+    parser.add_argument("--socket", default=SOCKET_PATH or "/tmp/slurpy-models.sock")
+    parser.add_argument("--embed-model", default=EMBED_MODEL)
+    args = parser.parse_args()
+
+    server = ModelServer(args.embed_model)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+prefork.py — Model preloading and worker warmup for fast, lean worker startup
+
+• preload_models(): called in the gunicorn master (gunicorn.conf.py,
+  preload_app) so the emotion model and the embedder are loaded once and
+  forked workers share their pages copy‑on‑write; gc.freeze() keeps the
+  collector from dirtying those pages afterwards
+• No inference runs in the master: torch/tokenizer thread pools and ONNX
+  Runtime sessions are not fork‑safe, so ONNX backends load per worker
+• warmup(): one forward pass through each model in the worker before it
+  reports ready (api.py lifespan), so the first request doesn't pay for it
+• Time‑to‑ready (since the worker process started) and unique memory (USS)
+  are logged and exported on /metrics as slurpy_worker_*
+
+Env
+- MODEL_WARMUP  (true/false, default true)
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+import time
+from typing import Dict
+
+WARMUP = os.getenv("MODEL_WARMUP", "true").lower() in {"1", "true", "yes"}
+
+_report: Dict[str, float] = {}
+
+
+def preload_models() -> float:
+    """Load shared models in the current (parent) process; returns the seconds taken."""
+    started = time.perf_counter()
+    from emotion.engine import BACKEND, ONNX_FILES, default_engine
+    from model_server import get_client
+    import memory
+
+    memory.get_embedder()
+    if get_client() is not None:
+        print("ℹ️ Model server configured - nothing to preload for emotion")
+    elif BACKEND in ONNX_FILES:
+        print("ℹ️ ONNX Runtime sessions are not fork-safe - emotion model loads per worker")
+    else:
+        default_engine()
+    gc.collect()
+    gc.freeze()
+    elapsed = time.perf_counter() - started
+    print(f"✅ Models preloaded in {elapsed:.1f}s (pid {os.getpid()})")
+    return elapsed
+
+
+def _memory_info() -> Dict[str, float]:
+    try:
+        import psutil
+        info = psutil.Process().memory_full_info()
+        return {"uss_bytes": float(info.uss), "rss_bytes": float(info.rss)}
+    except Exception:  # psutil missing or /proc/<pid>/smaps unreadable
+        return {}
+
+
+def _process_age() -> float:
+    try:
+        import psutil
+        return max(0.0, time.time() - psutil.Process().create_time())
+    except Exception:
+        return 0.0
+
+
+def warmup() -> Dict[str, float]:
+    """Warm both models once per worker and record time‑to‑ready; idempotent."""
+    if _report:
+        return _report
+    started = time.perf_counter()
+    if WARMUP:
+        from emotion.engine import default_engine
+        from model_server import get_client
+        import memory
+
+        try:
+            client = get_client()
+            if client is not None:
+                client.call_or("ping", [], lambda: None)
+            else:
+                default_engine().warmup()
+            memory.warmup_embedder()
+        except Exception as e:
+            print(f"⚠️ Warmup failed: {e}")
+
+    _report["warmup_seconds"] = time.perf_counter() - started
+    _report["ready_seconds"] = _process_age()
+    mem = _memory_info()
+    uss = f", USS {mem['uss_bytes'] / 2**20:.0f} MiB" if mem else ""
+    print(f"✅ Worker {os.getpid()} ready in {_report['ready_seconds']:.1f}s "
+          f"(warmup {_report['warmup_seconds'] * 1000:.0f} ms{uss})")
+    return _report
+
+
+def stats() -> Dict[str, float]:
+    return {**_report, **_memory_info()}
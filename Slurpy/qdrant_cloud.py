@@ -8,7 +8,7 @@ import argparse
 from qdrant_client import QdrantClient
 from qdrant_client.models import VectorParams, Distance, PointStruct, Record
 from qdrant_client.http.models import SparseVector
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from embedding_cache import cached_embedder
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
@@ -430,7 +430,7 @@ def add_new_documents(file_paths: List[str], source_name: Optional[str] = None)
     # Connect to cloud
     try:
         cloud_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API)
-        embedder = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        embedder = cached_embedder()
         print("✅ Connected to cloud")
     except Exception as e:
         print(f"❌ Failed to connect: {e}")
@@ -655,7 +655,7 @@ def upload_to_cloud() -> None:
         print(f"✅ Upload complete! Cloud now has {final_points_count} points")
         
         # Test search
-        embedder = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        embedder = cached_embedder()
         test_vector = embedder.embed_query("test search")
         
         test_results = cloud_client.search(
@@ -11,26 +11,32 @@ Key improvements:
 - Fixed all type errors
 """
 
-import os, warnings, json, datetime, pathlib, torch, requests, uuid, time, re, sqlite3, random
+import os, warnings, json, datetime, pathlib, requests, uuid, time, re, sqlite3, random
+import asyncio, atexit, contextvars, functools
 from collections import deque
-from typing import Deque, Tuple, List, Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Tuple, List, Optional, Dict, Any, Callable, TypeVar, AsyncIterator
 from contextlib import contextmanager
+from dataclasses import dataclass
 
 # Qdrant Cloud user memory
-from memory import add_message, recall
+from memory import MemoryHit, add_message, retrieve, memory_enabled, embed_text, connect_in_background, flush_memory
+from write_behind import WriteBehindQueue
+
+import metrics
+from metrics import stage, timed
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 warnings.filterwarnings("ignore")
 
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-from langchain_qdrant import Qdrant
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
 
 # emotion classifier
-from emotion.predict import _model as _emo_model, _tok as _emo_tok
+import emotion.engine as emotion_engine
+from emotion.engine import submit_emotion
+from emotion.fruits import fruit_for
+from model_server import get_client as get_model_client
 
 # ────────────────────────────────────────────────────────────────────────────
 # Enhanced conversation patterns and variety
@@ -105,19 +111,28 @@ def get_varied_follow_up(category: str) -> str:
 
 # ────────────────────────────────────────────────────────────────────────────
 # Memory integration helpers
-def get_personalized_context(user_id: str, current_msg: str) -> str:
-    """Get personalized context based on user's history"""
-    memories = recall(user_id, current_msg, k=5)
-    if not memories:
+def retrieve_memories(user_id: str, current_msg: str,
+                      query_vector: Optional[List[float]] = None) -> List[MemoryHit]:
+    """The turn's single memory lookup; everything else is derived from its hits"""
+    return retrieve(user_id, current_msg, k=5, query_vector=query_vector)
+
+def format_personalized_context(hits: List[MemoryHit]) -> str:
+    """Personalized context block from already-retrieved (ranked) hits"""
+    if not hits:
         return ""
     
     # Organize memories by relevance and recency
     memory_context = "Previous conversations show:\n"
-    for i, memory in enumerate(memories[:3]):
-        memory_context += f"• {memory}\n"
+    for hit in hits[:3]:
+        memory_context += f"• {hit.text}\n"
     
     return memory_context
 
+def get_personalized_context(user_id: str, current_msg: str,
+                             query_vector: Optional[List[float]] = None) -> str:
+    """Get personalized context based on user's history"""
+    return format_personalized_context(retrieve_memories(user_id, current_msg, query_vector))
+
 def extract_conversation_themes(user_msg: str, memories: List[str]) -> List[str]:
     """Extract ongoing themes from current message and memories"""
     themes: List[str] = []
@@ -318,8 +333,33 @@ def init_insights_db():
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # Session history rebuilds read a session's latest rows
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (user_id, session_id, id)'
+        )
         conn.commit()
 
+def load_session_history(user_id: str, session_id: str, limit: int) -> List[Tuple[str, str, str]]:
+    """Rebuild the last `limit` (user_text, assistant_text, user_emotion) turns of a session."""
+    with get_insights_db() as conn:
+        rows = conn.execute(
+            '''SELECT role, content, emotion FROM chat_messages
+               WHERE user_id = ? AND session_id = ?
+               ORDER BY id DESC LIMIT ?''',
+            (user_id, session_id, limit * 2)
+        ).fetchall()
+
+    turns: List[Tuple[str, str, str]] = []
+    pending_user: Optional[sqlite3.Row] = None
+    for row in reversed(rows):
+        if row["role"] == "user":
+            pending_user = row
+        elif row["role"] == "assistant" and pending_user is not None:
+            turns.append((pending_user["content"], row["content"], pending_user["emotion"] or "neutral"))
+            pending_user = None
+    return turns[-limit:]
+
+@timed("sqlite.session")
 def store_chat_session_analytics(session_id: str, user_id: str):
     with get_insights_db() as conn:
         conn.execute(
@@ -331,39 +371,77 @@ def store_chat_session_analytics(session_id: str, user_id: str):
 def store_enhanced_analytics(session_id: str, user_id: str, user_msg: str, 
                            assistant_response: str, emotion: str, intensity: float, themes: List[str]):
     """Store analytics with enhanced theme tracking"""
+    store_enhanced_analytics_batch([{
+        "session_id": session_id, "user_id": user_id, "user_msg": user_msg,
+        "assistant_response": assistant_response, "emotion": emotion,
+        "intensity": intensity, "themes": themes,
+    }])
+
+@timed("sqlite.analytics")
+def store_enhanced_analytics_batch(turns: List[Dict[str, Any]]) -> None:
+    """Insert the user + assistant rows for many turns in one transaction"""
+    rows = []
+    for t in turns:
+        themes_json = json.dumps(t["themes"]) if t["themes"] else None
+        rows.append((t["session_id"], t["user_id"], "user", t["user_msg"],
+                     t["emotion"], t["intensity"], themes_json, ""))
+        rows.append((t["session_id"], t["user_id"], "assistant", t["assistant_response"],
+                     "supportive", 0.8, themes_json, t["emotion"]))
     with get_insights_db() as conn:
-        themes_json = json.dumps(themes) if themes else None
-        conn.execute(
+        conn.executemany(
             '''INSERT INTO chat_messages 
                (session_id, user_id, role, content, emotion, intensity, themes, assistant_reaction)
                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-            (session_id, user_id, "user", user_msg, emotion, intensity, themes_json, "")
-        )
-        conn.execute(
-            '''INSERT INTO chat_messages 
-               (session_id, user_id, role, content, emotion, intensity, themes, assistant_reaction)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-            (session_id, user_id, "assistant", assistant_response, "supportive", 0.8, themes_json, emotion)
+            rows
         )
         conn.commit()
 
+def _insights_payload(session_id: str, message: str, role: str, emotion: Optional[str],
+                      intensity: Optional[float], topics: List[str]) -> Dict[str, Any]:
+    return {
+        "sessionId": session_id,
+        "message": message,
+        "role": role,
+        "emotion": emotion,
+        "intensity": intensity,
+        "topics": topics
+    }
+
+@timed("sync.nextjs")
 def sync_to_nextjs_api(user_id: str, session_id: str, message: str, role: str,
                        emotion: Optional[str], intensity: Optional[float], topics: List[str]):
     """Best‑effort sync to Next.js /api/insights; ignore failures so chat UX never breaks."""
     try:
         api_url = os.getenv("INSIGHTS_API_URL", "http://localhost:3000/api/insights")
-        payload = {
-            "sessionId": session_id,
-            "message": message,
-            "role": role,
-            "emotion": emotion,
-            "intensity": intensity,
-            "topics": topics
-        }
+        payload = _insights_payload(session_id, message, role, emotion, intensity, topics)
         requests.post(api_url, json=payload, timeout=5)
     except Exception:
         pass
 
+@timed("sync.nextjs")
+def sync_to_nextjs_api_batch(payloads: List[Dict[str, Any]], deadline: float = 5.0) -> List[Dict[str, Any]]:
+    """
+    POST many insights payloads over one connection; return the ones that failed.
+    The whole batch shares one `deadline` (seconds), and the first connection
+    error gives up on the rest — Next.js being down must not stall the worker.
+    """
+    api_url = os.getenv("INSIGHTS_API_URL", "http://localhost:3000/api/insights")
+    give_up_at = time.monotonic() + deadline
+    with requests.Session() as http:
+        for i, payload in enumerate(payloads):
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                return payloads[i:]
+            try:
+                resp = http.post(api_url, json=payload, timeout=min(5.0, remaining))
+                if resp.status_code >= 500:
+                    return payloads[i:]
+            except requests.ConnectionError:
+                return payloads[i:]
+            except requests.RequestException:
+                continue
+    return []
+
 # ────────────────────────────────────────────────────────────────────────────
 # Load environment and initialize
 load_dotenv()
@@ -419,22 +497,14 @@ def get_mode_config(mode: str) -> Dict[str, str]:
     return PERSONALITY_MODES.get(mode, PERSONALITY_MODES[DEFAULT_MODE])
 
 # Emotion detection
+@timed("emotion")
 def emotion_intensity(text: str) -> Tuple[str, float]:
-    inputs = _emo_tok(text, return_tensors="pt", truncation=True)
-    probs = torch.softmax(_emo_model(**inputs).logits, dim=1)[0]
-    idx = int(torch.argmax(probs))
-    label = _emo_model.config.id2label[idx]
-    return label, float(probs[idx])
-
-def fruit_for(emotion: str) -> str:
-    fruits = {
-        "joy": "Sunny Mango", "frustrated": "Tart Lemon", "excited": "Fizzy Orange",
-        "anxious": "Jittery Banana", "angry": "Spicy Chili", "calm": "Cool Melon",
-        "sad": "Gentle Blueberry", "hopeful": "Sweet Grape", "content": "Warm Peach",
-        "worried": "Sour Apple", "thoughtful": "Deep Plum", "proud": "Golden Apricot",
-        "neutral": "Fresh Cucumber"
-    }
-    return fruits.get(emotion, "Fresh Cucumber")
+    return submit_emotion(text).result()
+
+async def emotion_intensity_async(text: str) -> Tuple[str, float]:
+    """Awaits the micro-batcher directly — no executor thread parked on the result."""
+    with stage("emotion"):
+        return await asyncio.wrap_future(submit_emotion(text))
 
 def extract_topics_from_message(message: str) -> List[str]:
     topic_keywords = {
@@ -524,6 +594,151 @@ llm = ChatOpenAI(
     model_kwargs={"max_tokens": 400},
 )
 
+# ────────────────────────────────────────────────────────────────────────────
+# Async execution — blocking stages run in bounded pools off the event loop
+CHAT_CPU_WORKERS = int(os.getenv("CHAT_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+CHAT_IO_WORKERS = int(os.getenv("CHAT_IO_WORKERS", "16"))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", str(CHAT_CPU_WORKERS * 2)))
+
+_cpu_pool = ThreadPoolExecutor(max_workers=CHAT_CPU_WORKERS, thread_name_prefix="slurpy-cpu")
+_io_pool = ThreadPoolExecutor(max_workers=CHAT_IO_WORKERS, thread_name_prefix="slurpy-io")
+# Caps CPU-bound work admitted to the executor; extra callers wait (cancellably) on the loop
+_cpu_slots = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+
+_T = TypeVar("_T")
+
+async def run_cpu(fn: Callable[..., _T], *args: Any) -> _T:
+    """Run a CPU-bound stage (model inference) in the bounded CPU pool."""
+    async with _cpu_slots:
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            _cpu_pool, functools.partial(ctx.run, fn, *args)
+        )
+
+async def run_io(fn: Callable[..., _T], *args: Any) -> _T:
+    """Run a blocking I/O stage (Qdrant, SQLite, HTTP) in the I/O pool."""
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _io_pool, functools.partial(ctx.run, fn, *args)
+    )
+
+def shutdown_executors() -> None:
+    _cpu_pool.shutdown(wait=True, cancel_futures=True)
+    _io_pool.shutdown(wait=True, cancel_futures=True)
+    emotion_engine.shutdown()
+
+# ────────────────────────────────────────────────────────────────────────────
+# Turn pipeline helpers (shared by the sync and async entry points)
+GREETING_RESPONSES: List[str] = [
+    "Hey there! I'm really glad you're here. What's on your mind today?",
+    "Hi! Good to see you. How are you doing?",
+    "Hello! Thanks for stopping by. What would you like to talk about?",
+    "Hey! I'm here and ready to listen. What's going on?"
+]
+RETURNING_GREETING = "Good to see you again! Last time we talked about some important things. How have you been?"
+
+def canned_reply(msg: str, hist: History, mode: str, memories: List[str]) -> Optional[Tuple[str, str]]:
+    """Return (reply, path) for crisis/greeting turns that skip the LLM, else None."""
+    if is_self_harm(msg):
+        return handle_crisis_with_context(msg, mode, memories), "crisis"
+    if is_greeting(msg) and len(hist) == 0:
+        # First greeting - be welcoming
+        return random.choice(GREETING_RESPONSES), "greeting"
+    if is_greeting(msg) and memories:
+        # Returning user - show continuity
+        return RETURNING_GREETING, "greeting"
+    return None
+
+def build_full_prompt(msg: str, hist: History, user_id: str, mode: str,
+                      user_em: str, user_prob: float, themes: List[str],
+                      personalized_context: str, strategy: str) -> str:
+    # Build enhanced system prompt
+    system_prompt = build_personalized_system_prompt(user_id, msg, mode, themes)
+    
+    # Create the full prompt with context
+    context_section = ""
+    if personalized_context:
+        context_section = f"PERSONAL CONTEXT:\n{personalized_context}\n\n"
+    
+    if themes:
+        context_section += f"CONVERSATION THEMES: {', '.join(themes)}\n\n"
+    
+    return f"""
+{system_prompt}
+
+{context_section}CONVERSATION HISTORY:
+{format_history(hist)}
+
+CURRENT MESSAGE: {msg}
+USER EMOTION: {user_em} (intensity: {user_prob:.2f})
+
+RESPONSE GUIDANCE: {strategy}
+
+Respond naturally and specifically to what they've shared. Avoid repetitive phrases. 
+Show that you remember and care about their ongoing situation. Be genuinely helpful.
+"""
+
+def append_history(hist: History, msg: str, reply: str, user_em: str) -> None:
+    hist.append((msg, reply, user_em))
+    if len(hist) > 10:  # Keep more history for better context
+        hist.popleft()
+
+# ────────────────────────────────────────────────────────────────────────────
+# Write-behind: memory, analytics and sync writes happen after the reply is sent
+def _write_memories(batch: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    failed = [p for p in batch if not add_message(**p)]
+    # With Qdrant unconfigured there is nothing to retry
+    return failed if memory_enabled() else None
+
+writes = WriteBehindQueue(
+    spill_path=os.getenv("WRITE_BEHIND_SPILL", "write_behind_spill.jsonl"),
+    workers=int(os.getenv("WRITE_BEHIND_WORKERS", "2")),
+    max_batch=int(os.getenv("WRITE_BEHIND_BATCH", "64")),
+)
+writes.register("memory", _write_memories)
+writes.register("analytics", store_enhanced_analytics_batch)
+# Insights sync is best-effort (as it always was): failures are dropped, not spilled
+writes.register("sync", sync_to_nextjs_api_batch, spill=False)
+atexit.register(writes.close)
+metrics.register_stats("slurpy_write_behind", "Write-behind queue", writes.stats)
+metrics.register_stats("slurpy_emotion_batcher", "Emotion micro-batcher", emotion_engine.batcher_stats)
+if get_model_client() is not None:
+    metrics.register_stats("slurpy_model_client", "Model server client", get_model_client().stats)
+
+def start_writes() -> None:
+    """Start the write-behind workers (call from the app lifespan, not per request)."""
+    writes.start()
+
+def flush_writes(timeout: float = 10.0) -> None:
+    """Drain pending side effects (call on shutdown)."""
+    writes.close(timeout)
+    flush_memory(timeout)
+
+def embed_for_memory(msg: str) -> Optional[List[float]]:
+    """Embed the user message once per turn; recall and storage both reuse it."""
+    return embed_text(msg) if memory_enabled() else None
+
+def record_turn(session_id: str, user_id: str, msg: str, reply: str, user_em: str,
+                user_prob: float, themes: List[str], sync_reply: bool = False,
+                vector: Optional[List[float]] = None) -> None:
+    """Queue a finished turn's memory, analytics and Next.js insights writes."""
+    writes.enqueue("memory", {
+        "user_id": user_id, "text": msg, "emotion": user_em,
+        "fruit": fruit_for(user_em), "intensity": user_prob, "vector": vector,
+    })
+    writes.enqueue("analytics", {
+        "session_id": session_id, "user_id": user_id, "user_msg": msg,
+        "assistant_response": reply, "emotion": user_em,
+        "intensity": user_prob, "themes": themes,
+    })
+    topics = extract_topics_from_message(msg)
+    writes.enqueue("sync", _insights_payload(session_id, msg, "user", user_em, user_prob, topics))
+    if sync_reply:
+        writes.enqueue("sync", _insights_payload(session_id, reply, "assistant", "supportive", 0.8, themes))
+
+def fallback_reply(starter: str) -> str:
+    return f"I'm having a moment of technical difficulty, but I'm still here with you. {starter}"
+
 # Enhanced main response function
 def slurpy_answer(msg: str,
                   hist: History,
@@ -534,6 +749,7 @@ def slurpy_answer(msg: str,
     Generate Slurpy's answer with enhanced personalization and natural responses.
     Returns: (assistant_text, user_emotion, fruit_label)
     """
+    started = time.perf_counter()
     if user_id is None:
         user_id = "anonymous"
     if session_id is None:
@@ -545,9 +761,11 @@ def slurpy_answer(msg: str,
     # Get user's emotion
     user_em, user_prob = emotion_intensity(msg)
     
-    # Get personalized context from memory
-    memories = recall(user_id, msg, k=5)
-    personalized_context = get_personalized_context(user_id, msg)
+    # Get personalized context from memory (one embedding shared by every lookup)
+    query_vector = embed_for_memory(msg)
+    hits = retrieve_memories(user_id, msg, query_vector)
+    memories = [hit.text for hit in hits]
+    personalized_context = format_personalized_context(hits)
     
     # Extract themes from current message and history
     themes = extract_conversation_themes(msg, memories)
@@ -555,113 +773,237 @@ def slurpy_answer(msg: str,
     # Build recent responses to avoid repetition
     recent_responses = [response for _, response, _ in list(hist)[-3:]]
     
-    # Crisis handling
-    if is_self_harm(msg):
-        crisis_response = handle_crisis_with_context(msg, mode, memories)
-        hist.append((msg, crisis_response, user_em))
-        topics = extract_topics_from_message(msg)
-        store_enhanced_analytics(session_id, user_id, msg, crisis_response, user_em, user_prob, themes)
-        add_message(user_id, msg, user_em, fruit_for(user_em), user_prob)
-        sync_to_nextjs_api(user_id, session_id, msg, "user", user_em, user_prob, topics)
-        return crisis_response, user_em, fruit_for(user_em)
-    
-    # Handle greetings more naturally
-    if is_greeting(msg) and len(hist) == 0:
-        # First greeting - be welcoming
-        greeting_responses = [
-            "Hey there! I'm really glad you're here. What's on your mind today?",
-            "Hi! Good to see you. How are you doing?", 
-            "Hello! Thanks for stopping by. What would you like to talk about?",
-            "Hey! I'm here and ready to listen. What's going on?"
-        ]
-        greeting = random.choice(greeting_responses)
-        hist.append((msg, greeting, user_em))
-        topics = extract_topics_from_message(msg)
-        store_enhanced_analytics(session_id, user_id, msg, greeting, user_em, user_prob, themes)
-        add_message(user_id, msg, user_em, fruit_for(user_em), user_prob)
-        sync_to_nextjs_api(user_id, session_id, msg, "user", user_em, user_prob, topics)
-        return greeting, user_em, fruit_for(user_em)
-    
-    elif is_greeting(msg) and memories:
-        # Returning user - show continuity
-        greeting = "Good to see you again! Last time we talked about some important things. How have you been?"
-        hist.append((msg, greeting, user_em))
-        topics = extract_topics_from_message(msg)
-        store_enhanced_analytics(session_id, user_id, msg, greeting, user_em, user_prob, themes)
-        add_message(user_id, msg, user_em, fruit_for(user_em), user_prob)
-        sync_to_nextjs_api(user_id, session_id, msg, "user", user_em, user_prob, topics)
-        return greeting, user_em, fruit_for(user_em)
+    # Crisis handling and greetings
+    canned = canned_reply(msg, hist, mode, memories)
+    if canned is not None:
+        reply, path = canned
+        append_history(hist, msg, reply, user_em)
+        record_turn(session_id, user_id, msg, reply, user_em, user_prob, themes, vector=query_vector)
+        metrics.finish_turn(mode, path, time.perf_counter() - started)
+        return reply, user_em, fruit_for(user_em)
     
     # Generate contextual response
     starter, strategy = generate_contextual_response(msg, user_em, memories, themes, mode, recent_responses)
-    
-    # Build enhanced system prompt
-    system_prompt = build_personalized_system_prompt(user_id, msg, mode, themes)
-    
-    # Create the full prompt with context
-    context_section = ""
-    if personalized_context:
-        context_section = f"PERSONAL CONTEXT:\n{personalized_context}\n\n"
-    
-    if themes:
-        context_section += f"CONVERSATION THEMES: {', '.join(themes)}\n\n"
-    
-    full_prompt = f"""
-{system_prompt}
-
-{context_section}CONVERSATION HISTORY:
-{format_history(hist)}
-
-CURRENT MESSAGE: {msg}
-USER EMOTION: {user_em} (intensity: {user_prob:.2f})
-
-RESPONSE GUIDANCE: {strategy}
-
-Respond naturally and specifically to what they've shared. Avoid repetitive phrases. 
-Show that you remember and care about their ongoing situation. Be genuinely helpful.
-"""
+    full_prompt = build_full_prompt(msg, hist, user_id, mode, user_em, user_prob,
+                                    themes, personalized_context, strategy)
 
     # Generate response using LLM
     try:
-        response = str(llm.invoke(full_prompt).content).strip()
+        with stage("llm"):
+            response = str(llm.invoke(full_prompt).content).strip()
         
         # Clean up common AI artifacts
         response = clean_response(response, recent_responses)
-        
-        # Store in history and memory
-        hist.append((msg, response, user_em))
-        if len(hist) > 10:  # Keep more history for better context
-            hist.popleft()
-        
-        # Add to memory with themes
-        add_message(user_id, msg, user_em, fruit_for(user_em), user_prob)
-        
-        # Store analytics with themes
-        topics = extract_topics_from_message(msg)
-        store_enhanced_analytics(session_id, user_id, msg, response, user_em, user_prob, themes)
-        sync_to_nextjs_api(user_id, session_id, msg, "user", user_em, user_prob, topics)
-        sync_to_nextjs_api(user_id, session_id, response, "assistant", "supportive", 0.8, themes)
-        
-        return response, user_em, fruit_for(user_em)
-        
     except Exception as e:
         # Fallback response
         print(f"⚠️ LLM Error: {e}")
-        fallback = f"I'm having a moment of technical difficulty, but I'm still here with you. {starter}"
-        hist.append((msg, fallback, user_em))
-        topics = extract_topics_from_message(msg)
-        store_enhanced_analytics(session_id, user_id, msg, fallback, user_em, user_prob, themes)
-        add_message(user_id, msg, user_em, fruit_for(user_em), user_prob)
-        sync_to_nextjs_api(user_id, session_id, msg, "user", user_em, user_prob, topics)
+        fallback = fallback_reply(starter)
+        append_history(hist, msg, fallback, user_em)
+        record_turn(session_id, user_id, msg, fallback, user_em, user_prob, themes, vector=query_vector)
+        metrics.finish_turn(mode, "fallback", time.perf_counter() - started)
         return fallback, user_em, fruit_for(user_em)
 
+    # Store in history, memory and analytics
+    append_history(hist, msg, response, user_em)
+    record_turn(session_id, user_id, msg, response, user_em, user_prob, themes, sync_reply=True,
+                vector=query_vector)
+    metrics.finish_turn(mode, "llm", time.perf_counter() - started)
+    return response, user_em, fruit_for(user_em)
+
+@dataclass
+class PreparedTurn:
+    """Everything the async paths know about a turn before the reply exists."""
+    user_id: str
+    session_id: str
+    mode: str
+    started: float
+    user_em: str
+    user_prob: float
+    query_vector: Optional[List[float]]
+    hits: List[MemoryHit]
+    themes: List[str]
+    personalized_context: str
+    recent_responses: List[str]
+
+    @property
+    def memories(self) -> List[str]:
+        return [hit.text for hit in self.hits]
+
+    @property
+    def fruit(self) -> str:
+        return fruit_for(self.user_em)
+
+async def prepare_turn_async(msg: str, hist: History, user_id: Optional[str],
+                             mode: str, session_id: Optional[str]) -> PreparedTurn:
+    started = time.perf_counter()
+    if user_id is None:
+        user_id = "anonymous"
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+
+    # Session row, emotion and the message embedding are independent — run them together
+    _, (user_em, user_prob), query_vector = await asyncio.gather(
+        run_io(store_chat_session_analytics, session_id, user_id),
+        emotion_intensity_async(msg),
+        run_cpu(embed_for_memory, msg),
+    )
+    hits = await run_io(retrieve_memories, user_id, msg, query_vector)
+    memories = [hit.text for hit in hits]
+    return PreparedTurn(
+        user_id=user_id,
+        session_id=session_id,
+        mode=mode,
+        started=started,
+        user_em=user_em,
+        user_prob=user_prob,
+        query_vector=query_vector,
+        hits=hits,
+        themes=extract_conversation_themes(msg, memories),
+        recent_responses=[response for _, response, _ in list(hist)[-3:]],
+        personalized_context=format_personalized_context(hits),
+    )
+
+def finish_turn(msg: str, hist: History, turn: PreparedTurn, reply: str, path: str) -> None:
+    """Append the exchange to history and queue its writes (never blocks, so safe in a finally)."""
+    append_history(hist, msg, reply, turn.user_em)
+    record_turn(turn.session_id, turn.user_id, msg, reply,
+                turn.user_em, turn.user_prob, turn.themes, path == "llm", turn.query_vector)
+    metrics.finish_turn(turn.mode, path, time.perf_counter() - turn.started)
+
+async def finish_turn_async(msg: str, hist: History, turn: PreparedTurn, reply: str,
+                            path: str) -> None:
+    finish_turn(msg, hist, turn, reply, path)
+
+async def slurpy_answer_async(msg: str,
+                              hist: History,
+                              user_id: Optional[str] = None,
+                              mode: str = DEFAULT_MODE,
+                              session_id: Optional[str] = None) -> Tuple[str, str, str]:
+    """
+    Event-loop friendly slurpy_answer: inference runs in the CPU pool, Qdrant/SQLite/HTTP
+    in the I/O pool, and the LLM call is awaited natively.
+    Returns: (assistant_text, user_emotion, fruit_label)
+    """
+    turn = await prepare_turn_async(msg, hist, user_id, mode, session_id)
+
+    canned = canned_reply(msg, hist, mode, turn.memories)
+    if canned is not None:
+        reply, path = canned
+        await finish_turn_async(msg, hist, turn, reply, path)
+        return reply, turn.user_em, turn.fruit
+
+    starter, strategy = generate_contextual_response(
+        msg, turn.user_em, turn.memories, turn.themes, mode, turn.recent_responses)
+    full_prompt = build_full_prompt(msg, hist, turn.user_id, mode, turn.user_em, turn.user_prob,
+                                    turn.themes, turn.personalized_context, strategy)
+
+    try:
+        with stage("llm"):
+            result = await llm.ainvoke(full_prompt)
+        response = clean_response(str(result.content).strip(), turn.recent_responses)
+    except Exception as e:
+        print(f"⚠️ LLM Error: {e}")
+        fallback = fallback_reply(starter)
+        await finish_turn_async(msg, hist, turn, fallback, "fallback")
+        return fallback, turn.user_em, turn.fruit
+
+    await finish_turn_async(msg, hist, turn, response, "llm")
+    return response, turn.user_em, turn.fruit
+
+async def slurpy_answer_stream(msg: str,
+                               hist: History,
+                               user_id: Optional[str] = None,
+                               mode: str = DEFAULT_MODE,
+                               session_id: Optional[str] = None
+                               ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of slurpy_answer_async. Yields (event, data) pairs:
+      ("meta",  {session_id, emotion, fruit, mode})  — as soon as the emotion is known
+      ("token", {text})                               — raw LLM deltas
+      ("done",  {message})                            — final cleaned reply
+    History, memory and analytics writes happen once the stream has completed; if the
+    client goes away mid-stream (GeneratorExit / CancelledError) the turn is still
+    recorded with whatever reply was produced so far, under path="interrupted";
+    before the first token nothing is recorded beyond the turn's timing.
+    """
+    turn = await prepare_turn_async(msg, hist, user_id, mode, session_id)
+    parts: List[str] = []
+    finished = False
+
+    def finish(reply: str, path: str) -> None:
+        nonlocal finished
+        finished = True
+        finish_turn(msg, hist, turn, reply, path)
+
+    try:
+        yield "meta", {
+            "session_id": turn.session_id,
+            "emotion": turn.user_em,
+            "fruit": turn.fruit,
+            "mode": mode,
+        }
+
+        canned = canned_reply(msg, hist, mode, turn.memories)
+        if canned is not None:
+            reply, path = canned
+            parts.append(reply)
+            yield "token", {"text": reply}
+            finish(reply, path)
+            yield "done", {"message": reply}
+            return
+
+        starter, strategy = generate_contextual_response(
+            msg, turn.user_em, turn.memories, turn.themes, mode, turn.recent_responses)
+        full_prompt = build_full_prompt(msg, hist, turn.user_id, mode, turn.user_em, turn.user_prob,
+                                        turn.themes, turn.personalized_context, strategy)
+
+        llm_started = time.perf_counter()
+        try:
+            async for chunk in llm.astream(full_prompt):
+                text = str(chunk.content)
+                if text:
+                    if not parts:
+                        metrics.STAGE_SECONDS.observe(time.perf_counter() - llm_started,
+                                                      stage="llm.first_token", mode=mode, path="llm")
+                    parts.append(text)
+                    yield "token", {"text": text}
+        except Exception as e:
+            print(f"⚠️ LLM Error: {e}")
+            if not parts:
+                fallback = fallback_reply(starter)
+                parts.append(fallback)
+                yield "token", {"text": fallback}
+                finish(fallback, "fallback")
+                yield "done", {"message": fallback}
+                return
+            # Keep whatever was streamed before the failure
+
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - llm_started, stage="llm", mode=mode, path="llm")
+        response = clean_response("".join(parts).strip(), turn.recent_responses)
+        finish(response, "llm")
+        yield "done", {"message": response}
+    finally:
+        partial = "".join(parts).strip()
+        if not finished and partial:
+            # Client disconnected mid-stream: keep the exchange so the next turn's history has it
+            finish(partial, "interrupted")
+        elif not finished:
+            # Gone before any reply: an empty assistant turn would only pollute the next prompt
+            metrics.finish_turn(turn.mode, "interrupted", time.perf_counter() - turn.started)
+
 # Journal & Calendar helpers (keeping your existing functions)
 def add_journal_entry(user_id: str, title: str, content: str):
-    user_em, intensity = emotion_intensity(content)
+    # Journals run long: score the whole entry in windows instead of truncating it
+    with stage("emotion"):
+        scored = emotion_engine.default_engine().score_long(content)
+    user_em, intensity = scored.label, scored.score
     topics = extract_topics_from_message(content)
     # Store journal analytics...
-    add_message(user_id, f"Journal entry: {title}\n{content}", user_em, fruit_for(user_em), intensity)
-    print(f"📔 Journal entry added: {user_em} ({intensity:.2f}) - Topics: {topics}")
+    add_message(user_id, f"Journal entry: {title}\n{content}", user_em, fruit_for(user_em), intensity,
+                context={"peak_emotion": scored.peak_label, "peak_intensity": scored.peak_score,
+                         "emotion_timeline": scored.timeline, "emotion_truncated": scored.truncated})
+    print(f"📔 Journal entry added: {user_em} ({intensity:.2f}, peak {scored.peak_label} "
+          f"{scored.peak_score:.2f} over {len(scored.timeline)} windows) - Topics: {topics}")
 
 def add_calendar_event(user_id: str, title: str, description: str, event_date: datetime.datetime):
     full_text = f"{title} {description}"
@@ -676,6 +1018,7 @@ init_insights_db()
 
 # CLI runner for testing
 if __name__ == "__main__":
+    connect_in_background()
     mem: History = deque()
     current_mode = DEFAULT_MODE
     current_session_id = str(uuid.uuid4())
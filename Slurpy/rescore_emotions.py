@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+rescore_emotions.py — Backfill emotion labels after retraining emotion/model
+
+• chat_messages (user rows) and journal_entries in slurpy_insights.db:
+  keyset pages streamed with fetchmany, batched inference, one transaction of
+  batched UPDATEs per page
+• Qdrant user_memory_v2: scrolled pages, one batch_update_points request of
+  SetPayload operations (emotion / fruit / intensity) per page
+• Journals are scored with the same sliding windows as add_journal_entry;
+  calendar-event memories are skipped (add_calendar_event stores them as
+  neutral without classifying them)
+• A checkpoint JSON records progress per source after every committed page,
+  so an interrupted run resumes where it stopped; it is tied to the model
+  fingerprint, so retraining again starts over
+• Prints rows/s per page and a summary per source
+
+  python rescore_emotions.py                       # SQLite tables
+  python rescore_emotions.py --qdrant              # … and Qdrant memories
+  python rescore_emotions.py --only qdrant --dry-run
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from emotion.engine import MODEL_DIR, EmotionEngine, default_engine
+from emotion.fruits import fruit_for
+
+load_dotenv()
+
+SOURCES = ("chat_messages", "journal_entries", "qdrant")
+JOURNAL_PREFIX = "Journal entry:"
+CALENDAR_PREFIX = "Calendar event:"  # never classified on write, so never rescored
+
+# ── checkpoint ────────────────────────────────────────────────────
+def model_fingerprint(model_dir: str = MODEL_DIR) -> str:
+    """Changes whenever the weights or label map change."""
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            h.update(f"{name}:{st.st_size}:{int(st.st_mtime)}".encode())
+    return h.hexdigest()[:16]
+
+class Checkpoint:
+    def __init__(self, path: str, fingerprint: str, restart: bool = False):
+        self.path = path
+        self.state: Dict[str, Any] = {"model": fingerprint, "sources": {}}
+        if os.path.exists(path) and not restart:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("model") == fingerprint:
+                self.state = saved
+                print(f"♻️ Resuming from {path}: {saved['sources']}")
+            else:
+                print(f"🔄 Model changed since {path} was written - starting over")
+
+    def get(self, source: str, default: Any = None) -> Any:
+        return self.state["sources"].get(source, default)
+
+    def set(self, source: str, value: Any) -> None:
+        self.state["sources"][source] = value
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+# ── scoring ───────────────────────────────────────────────────────
+def score_texts(engine: EmotionEngine, texts: List[str], batch_size: int,
+                windowed: bool = False) -> List[Tuple[str, float]]:
+    if windowed:
+        return [(r.label, r.score) for r in (engine.score_long(t) for t in texts)]
+    return [(p.label, p.score) for p in engine.predict_stream(texts, batch_size=batch_size)]
+
+class Progress:
+    def __init__(self, source: str):
+        self.source = source
+        self.rows = 0
+        self.changed = 0
+        self.started = time.perf_counter()
+
+    def page(self, rows: int, changed: int, page_started: float) -> None:
+        self.rows += rows
+        self.changed += changed
+        page_rate = rows / max(time.perf_counter() - page_started, 1e-9)
+        print(f"   {self.source}: {self.rows} rows ({self.changed} relabelled) - {page_rate:.0f} rows/s")
+
+    def summary(self) -> None:
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        print(f"✅ {self.source}: {self.rows} rows, {self.changed} relabelled in {elapsed:.1f}s ({rate:.0f} rows/s)")
+
+# ── SQLite ────────────────────────────────────────────────────────
+TABLE_QUERIES = {
+    "chat_messages": ("SELECT id, content, emotion FROM chat_messages "
+                      "WHERE role = 'user' AND id > ? ORDER BY id LIMIT ?"),
+    "journal_entries": "SELECT id, content, emotion FROM journal_entries WHERE id > ? ORDER BY id LIMIT ?",
+}
+
+def _pages(conn: sqlite3.Connection, table: str, after: int, page_size: int,
+           fetch_size: int) -> Iterator[List[Tuple[int, str, Optional[str]]]]:
+    # Keyset pages: each SELECT finishes before its UPDATE transaction starts
+    while True:
+        cur = conn.execute(TABLE_QUERIES[table], (after, page_size))
+        page: List[Tuple[int, str, Optional[str]]] = []
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            page.extend(rows)
+        if not page:
+            return
+        yield page
+        after = page[-1][0]
+
+def rescore_table(conn: sqlite3.Connection, table: str, engine: EmotionEngine, ckpt: Checkpoint,
+                  page_size: int, batch_size: int, dry_run: bool) -> None:
+    print(f"📊 Rescoring {table}...")
+    progress = Progress(table)
+    windowed = table == "journal_entries"
+    for page in _pages(conn, table, ckpt.get(table, 0), page_size, batch_size):
+        page_started = time.perf_counter()
+        scores = score_texts(engine, [content for _, content, _ in page], batch_size, windowed)
+        updates = [(label, score, row_id) for (row_id, _, _), (label, score) in zip(page, scores)]
+        changed = sum(1 for (_, _, old), (label, _) in zip(page, scores) if old != label)
+        if not dry_run:
+            with conn:  # one transaction per page
+                conn.executemany(f"UPDATE {table} SET emotion = ?, intensity = ? WHERE id = ?", updates)
+            ckpt.set(table, page[-1][0])
+        progress.page(len(page), changed, page_started)
+    progress.summary()
+
+# ── Qdrant ────────────────────────────────────────────────────────
+def rescore_qdrant(collection: str, engine: EmotionEngine, ckpt: Checkpoint,
+                   page_size: int, batch_size: int, dry_run: bool) -> None:
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import SetPayload, SetPayloadOperation
+
+    url, api_key = os.getenv("QDRANT_URL"), os.getenv("QDRANT_API_KEY")
+    if not url or not api_key:
+        print("⚠️ Missing QDRANT_URL or QDRANT_API_KEY - skipping Qdrant")
+        return
+    client = QdrantClient(url=url, api_key=api_key, timeout=60, prefer_grpc=False)
+
+    print(f"📊 Rescoring Qdrant collection {collection}...")
+    progress = Progress(collection)
+    offset = ckpt.get("qdrant")
+    if offset == "done":
+        print(f"✅ {collection}: already complete")
+        return
+    while True:
+        page_started = time.perf_counter()
+        points, next_offset = client.scroll(
+            collection_name=collection, limit=page_size, offset=offset,
+            with_payload=["text", "emotion"], with_vectors=False,
+        )
+        points = [p for p in points if p.payload and p.payload.get("text")
+                  and not p.payload["text"].startswith(CALENDAR_PREFIX)]
+        journals = [p for p in points if p.payload["text"].startswith(JOURNAL_PREFIX)]
+        messages = [p for p in points if not p.payload["text"].startswith(JOURNAL_PREFIX)]
+        scored = list(zip(messages, score_texts(engine, [p.payload["text"] for p in messages], batch_size)))
+        scored += zip(journals, score_texts(engine, [p.payload["text"] for p in journals], batch_size, True))
+
+        changed = sum(1 for p, (label, _) in scored if p.payload.get("emotion") != label)
+        if scored and not dry_run:
+            client.batch_update_points(
+                collection_name=collection,
+                update_operations=[
+                    SetPayloadOperation(set_payload=SetPayload(
+                        payload={"emotion": label, "fruit": fruit_for(label), "intensity": float(score)},
+                        points=[p.id],
+                    ))
+                    for p, (label, score) in scored
+                ],
+                wait=True,
+            )
+        progress.page(len(scored), changed, page_started)
+        if next_offset is None:
+            if not dry_run:
+                ckpt.set("qdrant", "done")
+            break
+        offset = next_offset
+        if not dry_run:
+            ckpt.set("qdrant", offset)
+    progress.summary()
+
+# ── main ──────────────────────────────────────────────────────────
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-score stored emotions with the current emotion model")
+    parser.add_argument("--db", default="slurpy_insights.db", help="insights SQLite database")
+    parser.add_argument("--only", nargs="+", choices=SOURCES, help="sources to rescore (default: SQLite tables)")
+    parser.add_argument("--qdrant", action="store_true", help="also rescore Qdrant memories")
+    parser.add_argument("--collection", default="user_memory_v2", help="Qdrant memory collection")
+    parser.add_argument("--page-size", type=int, default=1000, help="rows per read/transaction")
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per forward pass")
+    parser.add_argument("--checkpoint", default="rescore_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="score and report, write nothing")
+    args = parser.parse_args()
+
+    sources = args.only or ["chat_messages", "journal_entries"] + (["qdrant"] if args.qdrant else [])
+    engine = default_engine()
+    ckpt = Checkpoint(args.checkpoint, model_fingerprint(engine.model_dir), args.restart)
+    print(f"🧠 Emotion model: {engine.backend} ({engine.model_dir}), sources: {', '.join(sources)}")
+
+    tables = [s for s in sources if s in TABLE_QUERIES]
+    if tables:
+        conn = sqlite3.connect(args.db)
+        try:
+            for table in tables:
+                rescore_table(conn, table, engine, ckpt, args.page_size, args.batch_size, args.dry_run)
+        finally:
+            conn.close()
+    if "qdrant" in sources:
+        rescore_qdrant(args.collection, engine, ckpt, args.page_size, args.batch_size, args.dry_run)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+session_store.py — Bounded in‑memory chat history per (user_id, session_id)
+
+• LRU order + idle TTL: untouched sessions expire, least‑recent go first
+• Budgets: max number of sessions and approximate bytes of history text
+• Misses are rebuilt lazily through a loader (rag_core reads chat_messages),
+  so eviction or a restart never loses conversational context
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+History = Deque[Tuple[str, str, str]]  # (user_text, assistant_text, user_emotion)
+SessionKey = Tuple[str, str]
+HistoryLoader = Callable[[str, str, int], List[Tuple[str, str, str]]]
+
+# Rough per-session overhead (deque + tuples + dict slot) on top of the text itself
+_ENTRY_OVERHEAD = 512
+
+
+def _history_bytes(hist: History) -> int:
+    return _ENTRY_OVERHEAD + sum(len(u) + len(a) + len(e) for u, a, e in hist)
+
+
+class _Entry:
+    __slots__ = ("hist", "size", "last_access")
+
+    def __init__(self, hist: History, now: float):
+        self.hist = hist
+        self.size = _history_bytes(hist)
+        self.last_access = now
+
+
+class SessionStore:
+    def __init__(
+        self,
+        loader: Optional[HistoryLoader] = None,
+        max_sessions: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        idle_ttl: float = 60 * 60,
+        history_len: int = 6,
+    ):
+        self._loader = loader
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.history_len = history_len
+
+        self._entries: "OrderedDict[SessionKey, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id: str, session_id: str, load: bool = True) -> History:
+        """Return the live history deque, rebuilding it from the loader on a miss."""
+        key = (user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._expire_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_access = now
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.hist
+            self.misses += 1
+
+        # Loader does a DB read — keep it outside the lock
+        rows: List[Tuple[str, str, str]] = []
+        if load and self._loader is not None:
+            try:
+                rows = self._loader(user_id, session_id, self.history_len)
+            except Exception as e:
+                print(f"⚠️ Session history reload failed: {e}")
+        hist: History = deque(rows, maxlen=self.history_len)
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:  # another request rebuilt it meanwhile
+                return existing.hist
+            entry = _Entry(hist, now)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._enforce_budget()
+        return hist
+
+    def commit(self, user_id: str, session_id: str) -> None:
+        """Re-account a session after a turn appended to its history."""
+        key = (user_id, session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            size = _history_bytes(entry.hist)
+            self._bytes += size - entry.size
+            entry.size = size
+            entry.last_access = time.monotonic()
+            self._entries.move_to_end(key)
+            self._enforce_budget()
+
+    def discard(self, user_id: str, session_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop((user_id, session_id), None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ── internals (caller holds the lock) ────────────────────────────────
+    def _expire_idle(self, now: float) -> None:
+        # LRU head is always the longest-idle session
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.last_access < self.idle_ttl:
+                break
+            self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.expirations += 1
+
+    def _enforce_budget(self) -> None:
+        # Never evict the most recent session, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_sessions or self._bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
@@ -0,0 +1,273 @@
+"""
+upsert_buffer.py — Buffered, batched Qdrant upserts with a local write‑ahead log
+
+• add(point_id, vector, payload) appends the point to an append‑only JSONL
+  log (flushed + fsynced) and to an in‑memory buffer, then returns
+• One flusher thread sends the buffer as a single upsert(wait=False) when it
+  holds `max_points` points or its oldest point is `max_age` seconds old;
+  failed flushes keep the points and are retried after `retry_delay`
+• The log is replayed on start, so a crash loses nothing that add() accepted;
+  it is compacted to the still‑unflushed points only once it holds twice as
+  many lines as are pending (or nothing is pending), so draining a backlog
+  stays linear. Already‑flushed points left in the log are simply upserted
+  again on replay (point ids are kept, so that is idempotent)
+• pending(user_id) exposes buffered points — plus recently flushed ones that
+  Qdrant may not have indexed yet — so recall can read its own writes
+• add() returns False when `max_pending` points are already waiting (Qdrant
+  down for a long time); the caller decides whether to spill or drop
+• claim_wal() gives each worker process its own log file, locked for the
+  process lifetime; a crashed worker's log is picked up by its replacement
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: one log per pid, no takeover
+    fcntl = None  # type: ignore[assignment]
+
+Point = Tuple[str, List[float], Dict[str, Any]]  # (id, vector, payload)
+Writer = Callable[[List[Point]], None]
+
+_claimed: List[Any] = []  # open lock files, held for the life of the process
+
+
+def claim_wal(base: str, slots: int = 64) -> Optional[str]:
+    """
+    First log file `<base>.<n>` no live process holds (so several workers never
+    share one); None when logging is disabled or every slot is taken.
+    """
+    if not base:
+        return None
+    if fcntl is None:
+        return f"{base}.{os.getpid()}"
+    for n in range(slots):
+        path = f"{base}.{n}"
+        handle = open(f"{path}.lock", "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _claimed.append(handle)
+        return path
+    print(f"⚠️ All {slots} memory WAL slots for {base} are in use - upserts are not logged")
+    return None
+
+
+class UpsertBuffer:
+    def __init__(
+        self,
+        writer: Writer,
+        wal_path: Optional[str],
+        max_points: int = 64,
+        max_age: float = 1.0,
+        max_pending: int = 10_000,
+        retry_delay: float = 5.0,
+        visible_for: float = 5.0,
+    ):
+        self.writer = writer
+        self.wal_path = wal_path
+        self.max_points = max(1, max_points)
+        self.max_age = max(0.0, max_age)
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.visible_for = visible_for
+
+        self._pending: "OrderedDict[str, Tuple[List[float], Dict[str, Any], float]]" = OrderedDict()
+        self._recent: "OrderedDict[str, Tuple[List[float], Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._wal_lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._retry_at = 0.0
+        self._flush_requested = False
+        self._inflight = 0
+        self._wal_lines = 0
+
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.rejected = 0
+        self._replay()
+
+    # ── public ──────────────────────────────────────────────────────────────
+    def add(self, point_id: str, vector: List[float], payload: Dict[str, Any]) -> bool:
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                return False
+        # Log and buffer under the WAL lock so a compaction never misses this point
+        with self._wal_lock:
+            self._append_wal(point_id, vector, payload)
+            with self._lock:
+                self._pending[point_id] = (vector, payload, time.monotonic())
+                if self._thread is None:
+                    self._start()
+                if len(self._pending) >= self.max_points:
+                    self._wake.notify()
+        return True
+
+    def pending(self, user_id: str) -> List[Point]:
+        """Buffered and just‑flushed points of one user, oldest first."""
+        cutoff = time.monotonic() - self.visible_for
+        with self._lock:
+            while self._recent and next(iter(self._recent.values()))[2] < cutoff:
+                self._recent.popitem(last=False)
+            return [(pid, vec, payload)
+                    for source in (self._recent, self._pending)
+                    for pid, (vec, payload, _) in source.items()
+                    if payload.get("user_id") == user_id]
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything added so far has been sent (or timeout)."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._retry_at = 0.0
+            self._flush_requested = True
+            self._wake.notify_all()
+            while self._pending or self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return not self._pending and not self._inflight
+                self._wake.wait(min(remaining, 0.05))
+            self._flush_requested = False
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        if not self.flush(timeout):
+            print(f"⚠️ Memory upsert buffer closed with {len(self._pending)} points kept in {self.wal_path}")
+        self._stop.set()
+        with self._lock:
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+    # ── flusher ─────────────────────────────────────────────────────────────
+    def _start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="memory-upsert", daemon=True)
+        self._thread.start()
+
+    def _due(self, now: float) -> bool:
+        if not self._pending or now < self._retry_at:
+            return False
+        if self._flush_requested or len(self._pending) >= self.max_points:
+            return True
+        oldest = next(iter(self._pending.values()))[2]
+        return now - oldest >= self.max_age
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._lock:
+                now = time.monotonic()
+                while not self._stop.is_set() and not self._due(now):
+                    if self._pending and now < self._retry_at:
+                        wait = self._retry_at - now
+                    elif self._pending:
+                        wait = self.max_age - (now - next(iter(self._pending.values()))[2])
+                    else:
+                        wait = 1.0
+                    self._wake.wait(max(wait, 0.001))
+                    now = time.monotonic()
+                if self._stop.is_set():
+                    return
+                batch = [(pid, vec, payload) for pid, (vec, payload, _) in
+                         list(self._pending.items())[:self.max_points]]
+                self._inflight = len(batch)
+            self._send(batch)
+
+    def _send(self, batch: List[Point]) -> None:
+        try:
+            self.writer(batch)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                self._inflight = 0
+                self._retry_at = time.monotonic() + self.retry_delay
+                self._wake.notify_all()
+            print(f"⚠️ Memory upsert of {len(batch)} points failed ({e}) - retrying in {self.retry_delay:.0f}s")
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            for pid, vec, payload in batch:
+                self._pending.pop(pid, None)
+                self._recent[pid] = (vec, payload, now)
+            self.flushed += len(batch)
+            self.batches += 1
+        self._rewrite_wal()
+        with self._lock:
+            self._inflight = 0
+            self._wake.notify_all()
+
+    # ── write‑ahead log ─────────────────────────────────────────────────────
+    @staticmethod
+    def _record(point_id: str, vector: List[float], payload: Dict[str, Any]) -> str:
+        return json.dumps({"id": point_id, "vector": vector, "payload": payload}, ensure_ascii=False) + "\n"
+
+    def _append_wal(self, point_id: str, vector: List[float], payload: Dict[str, Any]) -> None:
+        if not self.wal_path:
+            return
+        try:
+            with open(self.wal_path, "a", encoding="utf-8") as f:
+                f.write(self._record(point_id, vector, payload))
+                f.flush()
+                os.fsync(f.fileno())
+            self._wal_lines += 1
+        except Exception as e:
+            print(f"⚠️ Memory WAL append failed ({self.wal_path}): {e}")
+
+    def _rewrite_wal(self) -> None:
+        """Compact the log down to the points still waiting to be flushed, once it is mostly flushed."""
+        if not self.wal_path:
+            return
+        with self._wal_lock:
+            with self._lock:
+                if self._pending and self._wal_lines < 2 * len(self._pending) + self.max_points:
+                    return
+                lines = [self._record(pid, vec, payload) for pid, (vec, payload, _) in self._pending.items()]
+            tmp = f"{self.wal_path}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.wal_path)
+                self._wal_lines = len(lines)
+            except Exception as e:
+                print(f"⚠️ Memory WAL compaction failed ({self.wal_path}): {e}")
+
+    def _replay(self) -> None:
+        if not self.wal_path or not os.path.exists(self.wal_path):
+            return
+        now = time.monotonic()
+        with open(self.wal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn final line from a crash mid-append
+                self._pending[record["id"]] = (record["vector"], record["payload"], now)
+                self._wal_lines += 1
+        if self._pending:
+            print(f"♻️ Memory upserts: replaying {len(self._pending)} buffered points from {self.wal_path}")
+            self._start()
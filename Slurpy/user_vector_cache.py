@@ -0,0 +1,255 @@
+"""
+user_vector_cache.py — In‑process memory vectors for recently active users
+
+• On a user's first recall the loader fetches all of their points once; the
+  cache keeps them as one contiguous, L2‑normalized float32 matrix plus
+  compact payload columns (id, text, emotion, timestamp, ts, tags)
+• search() is exact cosine top‑k with NumPy (one mat‑vec + argpartition);
+  recent() orders by the ts column — neither touches the network
+• append() adds a new memory to a user already in the cache (amortized O(1),
+  the matrix grows by doubling)
+• Users are evicted least‑recently‑used to stay under a global byte budget;
+  users with more than `max_points` memories are never cached (the loader
+  returns None, search() returns None, the caller asks Qdrant)
+• Entries expire after `ttl` seconds, so writes made by other worker
+  processes (or rescore_emotions.py) show up within that window
+• One load per user at a time: concurrent readers wait for it, and appends
+  that arrive while it runs are applied to the loaded entry
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+Point = Tuple[str, List[float], Dict[str, Any]]  # (id, vector, payload)
+Loader = Callable[[str, int], Optional[List[Point]]]
+
+_ROW_OVERHEAD = 200  # bytes per row for the payload columns besides the text itself
+_LOAD_WAIT = 30.0    # longest a reader waits for another thread's load of the same user
+
+
+class _UserEntry:
+    __slots__ = ("matrix", "n", "ids", "texts", "emotions", "timestamps", "tags", "ts",
+                 "text_bytes", "loaded_at")
+
+    def __init__(self, points: List[Point], dim: int):
+        self.matrix = np.zeros((max(len(points), 8), dim), dtype=np.float32)
+        self.n = 0
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.emotions: List[str] = []
+        self.timestamps: List[str] = []
+        self.tags: List[Tuple[str, ...]] = []
+        self.ts = np.zeros(self.matrix.shape[0], dtype=np.int64)
+        self.text_bytes = 0
+        self.loaded_at = time.monotonic()
+        for point in points:
+            self.append(*point)
+
+    def append(self, point_id: str, vector: List[float], payload: Dict[str, Any]) -> None:
+        if self.n == self.matrix.shape[0]:
+            grown = np.zeros((self.n * 2, self.matrix.shape[1]), dtype=np.float32)
+            grown[:self.n] = self.matrix
+            self.matrix = grown
+            self.ts = np.concatenate([self.ts, np.zeros(self.n, dtype=np.int64)])
+        row = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(row))
+        self.matrix[self.n] = row / norm if norm else row
+        text = payload.get("text", "")
+        self.ts[self.n] = int(payload.get("ts") or 0)
+        self.ids.append(str(point_id))
+        self.texts.append(text)
+        self.emotions.append(payload.get("emotion", "neutral"))
+        self.timestamps.append(payload.get("timestamp", ""))
+        self.tags.append(tuple(payload.get("semantic_tags") or ()))
+        self.text_bytes += len(text)
+        self.n += 1
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.ts.nbytes + self.text_bytes + self.n * _ROW_OVERHEAD
+
+    def row(self, i: int) -> Dict[str, Any]:
+        return {"id": self.ids[i], "text": self.texts[i], "emotion": self.emotions[i],
+                "timestamp": self.timestamps[i], "ts": int(self.ts[i]),
+                "semantic_tags": list(self.tags[i])}
+
+
+class _Load:
+    """A load in flight: waiters block on `done`, appends queue in `appends`."""
+    __slots__ = ("done", "appends", "entry")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.appends: List[Point] = []
+        self.entry: Optional[_UserEntry] = None
+
+
+class UserVectorCache:
+    def __init__(self, loader: Loader, budget_bytes: int, max_points: int = 5000,
+                 ttl: float = 300.0):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self.max_points = max_points
+        self.ttl = ttl
+
+        self._entries: "OrderedDict[str, _UserEntry]" = OrderedDict()
+        self._loading: Dict[str, _Load] = {}
+        self._oversized: Dict[str, float] = {}  # user → when we last found them too big
+        self._bytes = 0
+        self._dim: Optional[int] = None  # vector size, learned from the first load or query
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.loads = 0
+        self.fallbacks = 0
+        self.evictions = 0
+
+    # ── reads ───────────────────────────────────────────────────────────────
+    def search(self, user_id: str, query_vector: List[float], limit: int,
+               score_threshold: float = 0.3) -> Optional[List[Dict[str, Any]]]:
+        """Exact cosine top‑`limit` as payload dicts with "similarity_score"; None → ask Qdrant."""
+        self._dim = self._dim or len(query_vector)
+        entry = self._entry(user_id)
+        if entry is None:
+            return None
+        if limit <= 0:
+            return []
+        q = np.array(query_vector, dtype=np.float32)
+        q /= float(np.linalg.norm(q)) or 1.0
+        # Rows are read under the lock too: append() may be growing the columns
+        with self._lock:
+            sims = entry.matrix[:entry.n] @ q
+            candidates = np.flatnonzero(sims >= score_threshold)
+            if candidates.size > limit:
+                candidates = candidates[np.argpartition(-sims[candidates], limit - 1)[:limit]]
+            candidates = candidates[np.argsort(-sims[candidates], kind="stable")]
+            return [{**entry.row(int(i)), "similarity_score": float(sims[i])} for i in candidates]
+
+    def recent(self, user_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """The user's `limit` newest memories by ts; None → ask Qdrant."""
+        entry = self._entry(user_id)
+        if entry is None:
+            return None
+        with self._lock:
+            newest = np.argsort(-entry.ts[:entry.n], kind="stable")[:limit]
+            return [entry.row(int(i)) for i in newest]
+
+    # ── writes ──────────────────────────────────────────────────────────────
+    def append(self, user_id: str, point_id: str, vector: List[float], payload: Dict[str, Any]) -> None:
+        """Add a new memory if the user is cached or being loaded (never triggers a load)."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                load = self._loading.get(user_id)
+                if load is not None:
+                    load.appends.append((point_id, vector, payload))  # the snapshot may predate it
+                return
+            before = entry.nbytes
+            entry.append(point_id, vector, payload)
+            self._bytes += entry.nbytes - before
+            if entry.n > self.max_points:
+                self._drop(user_id)
+                self._oversized[user_id] = time.monotonic()
+            self._enforce_budget()
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._drop(user_id)
+            self._oversized.pop(user_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        return {"users": len(self._entries), "bytes": self._bytes, "hits": self.hits,
+                "loads": self.loads, "fallbacks": self.fallbacks, "evictions": self.evictions}
+
+    # ── internals ───────────────────────────────────────────────────────────
+    def _entry(self, user_id: str) -> Optional[_UserEntry]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry.loaded_at < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._drop(user_id)  # expired
+            checked = self._oversized.get(user_id)
+            if checked is not None and now - checked < self.ttl:
+                self.fallbacks += 1
+                return None
+
+            load = self._loading.get(user_id)
+            owner = load is None
+            if owner:
+                load = self._loading[user_id] = _Load()
+
+        if not owner:
+            # Someone else is loading this user; share their result
+            load.done.wait(_LOAD_WAIT)
+            if load.entry is None:
+                self.fallbacks += 1
+            return load.entry
+
+        # Load outside the lock: a slow Qdrant scroll mustn't stall other users
+        entry = None
+        try:
+            points = self.loader(user_id, self.max_points)
+        except Exception as e:
+            print(f"⚠️ User vector cache load failed for {user_id[:8]}...: {e}")
+        else:
+            with self._lock:
+                entry = self._install(user_id, points, load.appends, now)
+        finally:
+            with self._lock:
+                del self._loading[user_id]
+                load.entry = entry
+                if entry is None:
+                    self.fallbacks += 1
+            load.done.set()
+        return entry
+
+    def _install(self, user_id: str, points: Optional[List[Point]], appends: List[Point],
+                 now: float) -> Optional[_UserEntry]:
+        """Build and cache the entry for a finished load (caller holds the lock)."""
+        if points is None:
+            if len(self._oversized) > 10_000:
+                self._oversized = {u: t for u, t in self._oversized.items() if now - t < self.ttl}
+            self._oversized[user_id] = now
+            return None
+        self._oversized.pop(user_id, None)
+        dim = len(points[0][1]) if points else len(appends[0][1]) if appends else self._dim
+        if dim is None:
+            return None
+        self._dim = dim
+        entry = _UserEntry(points, dim)  # may be empty: a new user's appends land here
+        seen = set(entry.ids)
+        for point_id, vector, payload in appends:
+            if str(point_id) not in seen:
+                entry.append(point_id, vector, payload)
+        if entry.n > self.max_points:
+            self._oversized[user_id] = now
+            return None
+        if entry.nbytes > self.budget_bytes:
+            return None
+        self._drop(user_id)
+        self._entries[user_id] = entry
+        self._bytes += entry.nbytes
+        self.loads += 1
+        self._enforce_budget()
+        return entry
+
+    def _drop(self, user_id: str) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def _enforce_budget(self) -> None:
+        while self._bytes > self.budget_bytes and self._entries:
+            user_id, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+            self.evictions += 1
@@ -0,0 +1,417 @@
+"""
+write_behind.py — Background write‑behind queue for post‑reply side effects
+
+• enqueue(sink, payload) returns immediately; worker threads drain the queue
+  and hand each sink a batch of payloads
+• Each process claims its own slot `<spill>.<n>` (see upsert_buffer.claim_wal,
+  so several gunicorn workers never replay the same records) for its spill
+  file and journal; a dead worker's slot is picked up by its replacement
+• Every accepted payload is also appended to the slot's journal, a series of
+  segments `<spill>.<n>.wal.<gen>`; a segment is deleted once all of its
+  payloads were written or spilled (never rewritten), so a crashed or killed
+  worker loses nothing; the next process to claim that slot moves leftover
+  segments to its spill file. Appends are flushed to the OS, not fsynced —
+  enqueue() runs on the event loop — so they survive a process crash but
+  not a power loss
+• When the queue is full, enqueue() parks the payload in a bounded overflow
+  buffer that the workers spill; past that it is dropped and counted
+• A sink returns the payloads it could not write (or raises for the whole
+  batch); those are appended to a JSONL spill file, replayed by a worker
+  thread on start and retried periodically while the queue is idle.
+  Sinks registered with spill=False are best‑effort: their failures are
+  counted as dropped
+• start() (call it from the app lifespan) only launches the workers;
+  flush() waits for the queue to drain; close() flushes and stops them
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from glob import glob
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from upsert_buffer import claim_wal
+
+Payload = Dict[str, Any]
+Sink = Callable[[List[Payload]], Optional[List[Payload]]]
+
+_SEGMENT_LINES = 1024  # journal lines per segment before a new one is started
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        spill_path: str,
+        workers: int = 2,
+        max_batch: int = 64,
+        max_delay: float = 0.05,
+        max_pending: int = 10_000,
+        max_spill_bytes: int = 50 * 1024 * 1024,
+        replay_interval: float = 60.0,
+        journal: bool = True,
+    ):
+        self.spill_path = spill_path
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_spill_bytes = max_spill_bytes
+        self.replay_interval = replay_interval
+        self.journal = journal
+
+        self._sinks: Dict[str, Sink] = {}
+        self._no_spill: Set[str] = set()
+        self._queue: "queue.Queue[Tuple[int, str, Payload]]" = queue.Queue(maxsize=max_pending)
+        self._overflow: "deque[Tuple[int, str, Payload]]" = deque()
+        self.max_overflow = max_pending
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._slot_path: Optional[str] = None  # this process's spill file, claimed on start
+
+        # Journal segments: seq → segment of each unsettled payload, segment → unsettled count
+        self._journal_lock = threading.Lock()
+        self._journal_base: Optional[str] = None
+        self._journal_file: Optional[Any] = None
+        self._journal_gen = 0
+        self._journal_lines = 0
+        self._unsettled: Dict[int, int] = {}
+        self._segments: Dict[int, int] = {}
+        self._orphans: List[str] = []  # segments left by a dead process, spilled on start
+        self._seq = count()
+
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def register(self, name: str, sink: Sink, spill: bool = True) -> None:
+        self._sinks[name] = sink
+        if not spill:
+            self._no_spill.add(name)
+
+    # ── lifecycle ───────────────────────────────────────────────────────────
+    def start(self) -> None:
+        """Launch the workers; the first one recovers the journal and replays the spill."""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._claim_slot()
+            self._open_journal()
+            self._stop.clear()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, args=(i == 0,),
+                                     name=f"write-behind-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def enqueue(self, sink: str, payload: Payload) -> None:
+        if not self._threads:
+            self.start()
+        seq = next(self._seq)
+        if sink not in self._no_spill:
+            self._append_journal(seq, sink, payload)
+        try:
+            self._queue.put_nowait((seq, sink, payload))
+        except queue.Full:
+            # Never block the request path: the workers spill the overflow
+            if len(self._overflow) < self.max_overflow:
+                self._overflow.append((seq, sink, payload))
+            else:
+                self.dropped += 1
+                self._settle([seq])
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything enqueued so far has been written or spilled."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        if not self._threads:
+            return
+        if not self.flush(timeout):
+            print(f"⚠️ Write-behind flush timed out with {self._queue.qsize()} pending writes")
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        self._threads = []
+        # Anything still queued would be lost with the process — keep it on disk
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            self._queue.task_done()
+        self._spill_items(leftovers)
+        self._spill_overflow()
+        self._close_journal()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self._queue.qsize() + len(self._overflow),
+            "written": self.written,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+    # ── workers ─────────────────────────────────────────────────────────────
+    def _run(self, replays: bool) -> None:
+        if replays:
+            self._recover()
+        last_replay = time.monotonic()
+        while not self._stop.is_set():
+            if self._overflow:
+                self._spill_overflow()
+            try:
+                first = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                # Idle: give sinks that were down another chance
+                if replays and time.monotonic() - last_replay > self.replay_interval:
+                    last_replay = time.monotonic()
+                    self._safely(self._replay_spill)
+                continue
+            items = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            finally:
+                self._settle([seq for seq, _, _ in items])
+                for _ in items:
+                    self._queue.task_done()
+
+    def _spill_overflow(self) -> None:
+        items = []
+        while True:
+            try:
+                items.append(self._overflow.popleft())
+            except IndexError:
+                break
+        self._spill_items(items)
+
+    def _spill_items(self, items: List[Tuple[int, str, Payload]]) -> None:
+        by_sink: Dict[str, List[Payload]] = {}
+        for _, sink, payload in items:
+            by_sink.setdefault(sink, []).append(payload)
+        for sink, payloads in by_sink.items():
+            self._spill(sink, payloads)
+        self._settle([seq for seq, _, _ in items])
+
+    def _write(self, items: List[Tuple[int, str, Payload]]) -> None:
+        by_sink: Dict[str, List[Payload]] = {}
+        for _, sink, payload in items:
+            by_sink.setdefault(sink, []).append(payload)
+
+        for sink, payloads in by_sink.items():
+            fn = self._sinks.get(sink)
+            if fn is None:
+                print(f"⚠️ Write-behind: no sink registered for '{sink}'")
+                self._spill(sink, payloads)
+                continue
+            try:
+                failed = fn(payloads) or []
+            except Exception as e:
+                print(f"⚠️ Write-behind sink '{sink}' failed: {e}")
+                failed = payloads
+            self.batches += 1
+            self.written += len(payloads) - len(failed)
+            if failed:
+                self._spill(sink, failed)
+
+    def _recover(self) -> None:
+        """Startup work for worker 0: never lets an error end the thread that retries the spill."""
+        self._safely(self._adopt_shared_spill)
+        self._safely(self._recover_journal)
+        self._safely(self._replay_spill)
+
+    @staticmethod
+    def _safely(step: Callable[[], None]) -> None:
+        try:
+            step()
+        except Exception as e:
+            print(f"⚠️ Write-behind {step.__name__} failed: {e}")
+
+    # ── spill file ──────────────────────────────────────────────────────────
+    def _claim_slot(self) -> str:
+        if self._slot_path is None:
+            self._slot_path = claim_wal(self.spill_path) or f"{self.spill_path}.{os.getpid()}"
+        return self._slot_path
+
+    def _adopt_shared_spill(self) -> None:
+        """Move a spill file shared by every worker (older releases) into slot 0 only."""
+        if self._claim_slot() != f"{self.spill_path}.0":
+            return
+        for legacy in (f"{self.spill_path}.replay", self.spill_path):
+            if not os.path.exists(legacy):
+                continue
+            with self._spill_lock:
+                with open(legacy, encoding="utf-8") as src, open(self._slot_path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(legacy)
+            print(f"♻️ Write-behind: adopted {legacy} into {self._slot_path}")
+
+    def _spill(self, sink: str, payloads: List[Payload]) -> None:
+        if sink in self._no_spill:
+            self.dropped += len(payloads)
+            return
+        path = self._claim_slot()
+        with self._spill_lock:
+            try:
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                if size > self.max_spill_bytes:
+                    self.dropped += len(payloads)
+                    print(f"⚠️ Write-behind spill file full — dropped {len(payloads)} '{sink}' writes")
+                    return
+                with open(path, "a", encoding="utf-8") as f:
+                    for payload in payloads:
+                        f.write(json.dumps({"sink": sink, "payload": payload}, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.spilled += len(payloads)
+            except Exception as e:
+                self.dropped += len(payloads)
+                print(f"⚠️ Write-behind spill failed ({sink}): {e}")
+
+    def _replay_spill(self) -> None:
+        path = self._claim_slot()
+        replay_path = f"{path}.replay"
+        with self._spill_lock:
+            # A leftover .replay file means we crashed mid-replay last time; redo it first
+            if os.path.exists(path) and not os.path.exists(replay_path):
+                os.replace(path, replay_path)
+
+        replayed = 0
+        try:
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line from a crash mid-write
+                    self.enqueue(record["sink"], record["payload"])
+                    replayed += 1
+            os.remove(replay_path)
+        except FileNotFoundError:
+            return
+        if replayed:
+            print(f"♻️ Write-behind: replaying {replayed} spilled writes")
+
+    # ── journal ─────────────────────────────────────────────────────────────
+    def _open_journal(self) -> None:
+        if not self.journal or self._journal_file is not None:
+            return
+        base = self._journal_base or f"{self._claim_slot()}.wal"
+        try:
+            # Segments left by a process that died holding this slot; worker 0 spills them
+            self._orphans = sorted(glob(f"{base}*"))
+            gens = [int(p.rsplit(".", 1)[1]) for p in self._orphans if p.rsplit(".", 1)[1].isdigit()]
+            self._journal_gen = max(gens, default=-1) + 1
+            self._journal_file = open(f"{base}.{self._journal_gen}", "w", encoding="utf-8")
+            self._journal_base = base
+            self._journal_lines = 0
+        except Exception as e:
+            print(f"⚠️ Write-behind journal unavailable ({base}): {e}")
+
+    def _append_journal(self, seq: int, sink: str, payload: Payload) -> None:
+        line = json.dumps({"sink": sink, "payload": payload}, ensure_ascii=False) + "\n"
+        with self._journal_lock:
+            if self._journal_file is None:
+                return
+            try:
+                self._journal_file.write(line)
+                self._journal_file.flush()
+            except Exception as e:
+                print(f"⚠️ Write-behind journal append failed: {e}")
+                return
+            self._unsettled[seq] = self._journal_gen
+            self._segments[self._journal_gen] = self._segments.get(self._journal_gen, 0) + 1
+            self._journal_lines += 1
+
+    def _settle(self, seqs: List[int]) -> None:
+        """Forget written/spilled payloads; start a new segment and delete fully settled ones."""
+        with self._journal_lock:
+            for seq in seqs:
+                gen = self._unsettled.pop(seq, None)
+                if gen is not None:
+                    self._segments[gen] -= 1
+            if self._journal_file is not None and self._journal_lines >= _SEGMENT_LINES:
+                try:
+                    new_file = open(f"{self._journal_base}.{self._journal_gen + 1}", "w", encoding="utf-8")
+                except Exception as e:
+                    print(f"⚠️ Write-behind journal rotation failed: {e}")
+                else:
+                    self._journal_file.close()
+                    self._journal_file = new_file
+                    self._segments.setdefault(self._journal_gen, 0)
+                    self._journal_gen += 1
+                    self._journal_lines = 0
+            done = [gen for gen, left in self._segments.items() if left == 0 and gen != self._journal_gen]
+            for gen in done:
+                del self._segments[gen]
+        for gen in done:
+            try:
+                os.remove(f"{self._journal_base}.{gen}")
+            except OSError:
+                pass
+
+    def _close_journal(self) -> None:
+        with self._journal_lock:
+            if self._journal_file is None:
+                return
+            self._journal_file.close()
+            self._journal_file = None
+            if self._unsettled:
+                return
+            self._segments.clear()
+        for path in glob(f"{self._journal_base}.*"):
+            if path.rsplit(".", 1)[1].isdigit() and path not in self._orphans:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _recover_journal(self) -> None:
+        leftovers: Dict[str, List[Payload]] = {}
+        for path in self._orphans:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # torn final line from a crash mid-append
+                        leftovers.setdefault(record["sink"], []).append(record["payload"])
+            except FileNotFoundError:
+                continue
+        for sink, payloads in leftovers.items():
+            self._spill(sink, payloads)
+        for path in self._orphans:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        recovered = sum(len(p) for p in leftovers.values())
+        if recovered:
+            print(f"♻️ Write-behind: recovered {recovered} unwritten writes from {len(self._orphans)} journal segments")
+        self._orphans = []